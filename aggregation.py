@@ -0,0 +1,194 @@
+"""Vectorized (weighted) group means over the simulation results."""
+
+import numpy as np
+import pandas as pd
+
+
+def intervention_label(target_min, target_max, preset):
+    """Label of a target/preset intervention to display in the plot."""
+    return f"Target: {target_min}-{target_max}\nPreset: {int(preset*100)}%"
+
+
+def intervention_labels(target_min, target_max, preset):
+    """Categorical of the intervention_label of each row.
+
+    The strings are formatted once per distinct intervention, not per row.
+    """
+    keys = pd.DataFrame(
+        {
+            "target_min": np.asarray(target_min),
+            "target_max": np.asarray(target_max),
+            "preset": np.asarray(preset),
+        }
+    )
+    inverse, groups = group_codes(keys, list(keys.columns))
+    labels = [
+        intervention_label(*v)
+        for v in zip(groups["target_min"], groups["target_max"], groups["preset"])
+    ]
+    label_codes, categories = pd.factorize(pd.Index(labels))
+    return pd.Categorical.from_codes(label_codes[inverse], categories)
+
+
+def target_labels(target_min):
+    """Target range of each target_min, as shown in the plot legend."""
+    target_min = pd.Series(np.asarray(target_min))
+    return target_min.astype(str) + "-" + (target_min + 20).astype(str)
+
+
+def group_codes(df, keys):
+    """Integer group code per row and the sorted distinct key combinations."""
+    code = np.zeros(len(df), dtype=np.int64)
+    levels = []
+    for key in keys:
+        key_codes, uniques = pd.factorize(df[key], sort=True)
+        code = code * len(uniques) + key_codes
+        levels.append(uniques)
+    group_ids, inverse = np.unique(code, return_inverse=True)
+    # decode the combined codes back into one column per key
+    key_values = {}
+    for key, uniques in zip(reversed(keys), reversed(levels)):
+        key_values[key] = np.asarray(uniques)[group_ids % len(uniques)]
+        group_ids = group_ids // len(uniques)
+    groups = pd.DataFrame({key: key_values[key] for key in keys})
+    return inverse, groups
+
+
+def group_sums(values, inverse, n_groups, weights=None):
+    """Per-group sums of weight * value and of weight over the non-NaN values.
+
+    values is an (n_rows, n_metrics) array; returns two (n_groups, n_metrics)
+    arrays.
+    """
+    present = ~np.isnan(values)
+    w = np.ones(len(values)) if weights is None else np.asarray(weights, float)
+    weighted = np.where(present, values * w[:, None], 0.0)
+    w_present = present * w[:, None]
+    sums = np.empty((n_groups, values.shape[1]))
+    w_sums = np.empty((n_groups, values.shape[1]))
+    for j in range(values.shape[1]):
+        sums[:, j] = np.bincount(inverse, weights=weighted[:, j], minlength=n_groups)
+        w_sums[:, j] = np.bincount(inverse, weights=w_present[:, j], minlength=n_groups)
+    return sums, w_sums
+
+
+def group_means(df, keys, metrics, weights=None):
+    """Mean of each metric per group of keys, weighted by weights if given.
+
+    Equivalent to ``df.groupby(keys).mean()`` (or ``np.average`` per group with
+    weights) but computed in one pass with bincount on integer group codes.
+    NaN metric values are skipped like in ``DataFrame.mean``.
+    """
+    inverse, groups = group_codes(df, keys)
+    values = df[metrics].to_numpy(dtype=np.float64)
+    sums, w_sums = group_sums(values, inverse, len(groups), weights)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / w_sums
+    for j, metric in enumerate(metrics):
+        groups[metric] = means[:, j]
+    return groups
+
+
+def bootstrap_intervals(
+    values,
+    inverse,
+    n_groups,
+    weights=None,
+    n_resamples=1000,
+    confidence=0.95,
+    seed=0,
+    batch_values=2**22,
+):
+    """Percentile bootstrap confidence intervals of the group_sums means.
+
+    Each resample draws, within every group, as many rows as the group has,
+    with replacement. The draws of a batch of resamples are one index matrix
+    of shape (resamples, rows) into the rows sorted by group, so the
+    resampled weighted sums of all groups are a gather and an add.reduceat
+    per metric, with no loop over groups or resamples. Batches hold at most
+    batch_values indices; the draws don't depend on the batching, so a seed
+    gives the same intervals. Returns the lower and upper bounds as two
+    (n_groups, n_metrics) arrays.
+    """
+    n_rows, n_metrics = values.shape
+    lo = np.full((n_groups, n_metrics), np.nan)
+    hi = np.full((n_groups, n_metrics), np.nan)
+    if n_rows == 0:
+        return lo, hi
+    order = np.argsort(inverse, kind="stable")
+    sizes = np.bincount(inverse, minlength=n_groups)
+    starts = np.cumsum(sizes) - sizes
+    groups = np.flatnonzero(sizes)  # reduceat needs non-empty groups
+    values = values[order]
+    present = ~np.isnan(values)
+    w = np.ones(n_rows) if weights is None else np.asarray(weights, float)[order]
+    weighted = np.where(present, values * w[:, None], 0.0)
+    w_present = present * w[:, None]
+    row_start = np.repeat(starts, sizes).astype(np.uint64)
+    row_size = np.repeat(sizes, sizes).astype(np.uint64)
+
+    rng = np.random.default_rng(seed)
+    means = np.empty((n_resamples, len(groups), n_metrics))
+    batch = max(1, batch_values // n_rows)
+    for b in range(0, n_resamples, batch):
+        n = min(batch, n_resamples - b)
+        # 32 random bits times the group size, shifted back by 32 bits, is a
+        # row of the group; faster than drawing bounded integers directly
+        draws = rng.integers(0, 2**32, size=(n, n_rows), dtype=np.uint64)
+        draws *= row_size
+        draws >>= np.uint64(32)
+        draws += row_start
+        index = draws.view(np.int64)
+        w_all = None  # weight sums of the metrics without NaN, shared
+        for j in range(n_metrics):
+            if present[:, j].all():
+                if w_all is None:
+                    w_all = np.add.reduceat(w[index], starts[groups], axis=1)
+                w_sums = w_all
+            else:
+                # skip the NaN of this metric only, like group_means
+                w_sums = np.add.reduceat(w_present[:, j][index], starts[groups], axis=1)
+            sums = np.add.reduceat(weighted[:, j][index], starts[groups], axis=1)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                means[b : b + n, :, j] = sums / w_sums
+    alpha = (1 - confidence) / 2
+    lo[groups], hi[groups] = np.quantile(means, [alpha, 1 - alpha], axis=0)
+    return lo, hi
+
+
+class GroupSums:
+    """Running per-group sums, for aggregating results that arrive in chunks.
+
+    ``add`` folds a chunk into the totals, so memory is bounded by the chunk
+    size and the number of groups rather than the number of rows.
+    """
+
+    def __init__(self, keys, metrics):
+        self.keys = keys
+        self.metrics = metrics
+        self.sums = None  # DataFrame indexed by the keys
+
+    def add(self, df, weights=None):
+        if len(df) == 0:
+            return
+        inverse, groups = group_codes(df, self.keys)
+        values = df[self.metrics].to_numpy(dtype=np.float64)
+        sums, w_sums = group_sums(values, inverse, len(groups), weights)
+        index = pd.MultiIndex.from_frame(groups)
+        chunk = pd.concat(
+            [
+                pd.DataFrame(sums, index=index, columns=self.metrics),
+                pd.DataFrame(w_sums, index=index, columns=self.metrics),
+            ],
+            axis=1,
+            keys=["sum", "weight"],
+        )
+        self.sums = chunk if self.sums is None else self.sums.add(chunk, fill_value=0)
+
+    def means(self):
+        """Mean of each metric per group, as group_means returns it."""
+        if self.sums is None:
+            return pd.DataFrame(columns=self.keys + self.metrics)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = self.sums["sum"] / self.sums["weight"]
+        return means.sort_index().reset_index()
@@ -0,0 +1,105 @@
+// Clientside renderer of the scatter plot, used when the app runs with
+// CLIENTSIDE_RENDERING=1. It mirrors figures.build_figure on the aggregated
+// table that the server ships once per data-affecting dropdown change, so
+// changing the plotted metrics does not need a server round trip.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    t1d: {
+        buildFigure: function (aggregate, xMetric, yMetric, style) {
+            if (!aggregate || !aggregate.table) {
+                return window.dash_clientside.no_update;
+            }
+            const table = aggregate.table;
+            const activity = aggregate.inputs[0];
+            const t1dexiPreset = style.t1dexi_presets[activity];
+            const rows = table.label.map((_, i) => i);
+            const fmt = (v) => v.toFixed(2);
+
+            // one trace per target, sized by preset like px.scatter(size_max=18)
+            const sizeMax = 18;
+            const sizeref = Math.max(...table.size) / (sizeMax * sizeMax);
+            const targets = [...new Set(table.Target)];
+            const data = targets.map((target) => {
+                const idx = rows.filter((i) => table.Target[i] === target);
+                return {
+                    type: "scatter",
+                    mode: "markers",
+                    name: target,
+                    legendgroup: target,
+                    showlegend: true,
+                    orientation: "v",
+                    x: idx.map((i) => table[xMetric][i]),
+                    y: idx.map((i) => table[yMetric][i]),
+                    customdata: idx.map((i) => [table.label[i]]),
+                    marker: {
+                        color: style.color_map[target],
+                        opacity: 0.75,
+                        size: idx.map((i) => table.size[i]),
+                        sizemode: "area",
+                        sizeref: sizeref,
+                        symbol: "circle",
+                    },
+                    hovertemplate:
+                        xMetric + "=%{x}<br>" + yMetric + "=%{y}<br>" +
+                        "label=%{customdata[0]}<extra></extra>",
+                };
+            });
+
+            // highlighted intervention points
+            const highlight = (name, target, preset, marker) => {
+                const idx = rows.filter(
+                    (i) => table.Target[i] === target && table.preset[i] === preset
+                );
+                if (idx.length === 0) {
+                    return;
+                }
+                const i = idx[0];
+                data.push({
+                    type: "scatter",
+                    mode: "markers",
+                    name: name,
+                    showlegend: true,
+                    x: idx.map((j) => table[xMetric][j]),
+                    y: idx.map((j) => table[yMetric][j]),
+                    customdata: idx.map((j) => [table.label[j]]),
+                    marker: Object.assign({line: {width: 0}}, marker),
+                    hovertemplate:
+                        xMetric + ": " + fmt(table[xMetric][i]) + "<br>" +
+                        yMetric + ": " + fmt(table[yMetric][i]) + "<br>" +
+                        "%{customdata[0]}<extra></extra>",
+                });
+            };
+            const presetPct = Math.trunc(t1dexiPreset * 100);
+            highlight(
+                "No Action<br><sub>Default target 100-120, Preset 100%</sub>",
+                "100-120", 1.0, {symbol: "diamond", color: "#A1BB97", size: 14}
+            );
+            highlight(
+                "Raised Target<br><sub>Target 150-170, Preset 100%</sub>",
+                "150-170", 1.0, {symbol: "diamond", color: "#E5CFA4", size: 14}
+            );
+            highlight(
+                "Preset Only<br><sub>Default target 100-120, T1DEXI Preset " +
+                    presetPct + "%</sub>",
+                "100-120", t1dexiPreset, {symbol: "star", color: "#D4938B", size: 18}
+            );
+            highlight(
+                "Preset + Raised Target<br><sub>Target 150-170, Preset " +
+                    presetPct + "%</sub>",
+                "150-170", t1dexiPreset, {symbol: "star", color: "pink", size: 18}
+            );
+
+            const layout = Object.assign({}, style.layout, {
+                template: style.template,
+                title: Object.assign({}, style.layout.title, {
+                    text: yMetric + " vs " + xMetric + " for " + activity,
+                }),
+                xaxis: {anchor: "y", domain: [0.0, 1.0], title: {text: xMetric}},
+                yaxis: {anchor: "x", domain: [0.0, 1.0], title: {text: yMetric}},
+                legend: Object.assign({}, style.layout.legend, {
+                    itemsizing: "constant",
+                }),
+            });
+            return {data: data, layout: layout};
+        },
+    },
+});
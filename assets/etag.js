@@ -0,0 +1,52 @@
+// Conditional callback requests. Browsers don't revalidate POST requests, so
+// this keeps the bodies of the last callback responses that carried an ETag
+// (the figures, see responses.py) and sends their ETags with the same
+// request again. A 304 from the server is answered from the kept body.
+(function () {
+    const maxEntries = 32;
+    const kept = new Map(); // request body -> {etag, body, contentType}
+    const fetch = window.fetch.bind(window);
+
+    window.fetch = async function (input, init) {
+        const url = typeof input === "string" ? input : input.url;
+        if (
+            !url.includes("_dash-update-component") ||
+            !init ||
+            init.method !== "POST" ||
+            typeof init.body !== "string"
+        ) {
+            return fetch(input, init);
+        }
+        const entry = kept.get(init.body);
+        if (entry) {
+            init = Object.assign({}, init, {
+                headers: Object.assign({}, init.headers, {
+                    "If-None-Match": entry.etag,
+                }),
+            });
+        }
+        const response = await fetch(input, init);
+        if (response.status === 304 && entry) {
+            kept.delete(init.body); // most recently used last
+            kept.set(init.body, entry);
+            return new Response(entry.body, {
+                status: 200,
+                headers: {"Content-Type": entry.contentType},
+            });
+        }
+        const etag = response.headers.get("ETag");
+        if (response.status === 200 && etag) {
+            const body = await response.clone().text();
+            kept.delete(init.body);
+            kept.set(init.body, {
+                etag: etag,
+                body: body,
+                contentType: response.headers.get("Content-Type"),
+            });
+            if (kept.size > maxEntries) {
+                kept.delete(kept.keys().next().value);
+            }
+        }
+        return response;
+    };
+})();
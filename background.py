@@ -0,0 +1,81 @@
+"""Dash background callback manager for a threaded, multi-process server.
+
+Dash's DiskcacheManager runs every job in a forked process that stores its
+result in a SQLite-backed diskcache. Under gunicorn with several workers and
+threads, three things go wrong with the stock manager:
+
+* results are keyed by a hash of the inputs, so users requesting the same
+  view at once (everyone opening the app) fetch, and delete, each other's
+  results, and the others never get theirs;
+* a job forked while another thread of its worker was using SQLite (this
+  cache or the figure cache) inherits SQLite's locks in that state, and
+  hangs when it stores its result;
+* terminating a job waits for it to exit while holding the cache's write
+  lock, which takes a full second when the job belongs to another worker
+  (only its parent can reap it), and every poll terminates a job.
+
+make_manager returns a manager without these problems.
+"""
+
+import contextlib
+import os
+import uuid
+
+import dash
+import diskcache
+import psutil
+
+import figure_cache
+from figure_cache import locked
+
+
+class BackgroundCache(diskcache.Cache):
+    """diskcache.Cache that uses SQLite under figure_cache.sqlite_lock."""
+
+    get = locked(diskcache.Cache.get)
+    set = locked(diskcache.Cache.set)
+    delete = locked(diskcache.Cache.delete)
+    touch = locked(diskcache.Cache.touch)
+    close = locked(diskcache.Cache.close)
+
+    @contextlib.contextmanager
+    def _transact(self, retry=False, filename=None):
+        # every write transaction (set, delete, touch, transact) goes through here
+        with figure_cache.sqlite_lock:
+            with super()._transact(retry, filename) as transaction:
+                yield transaction
+
+
+class BackgroundManager(dash.DiskcacheManager):
+    def call_job_fn(self, key, job_fn, args, context):
+        with figure_cache.sqlite_lock:
+            return super().call_job_fn(key, job_fn, args, context)
+
+    def terminate_job(self, job):
+        if job is None:
+            return
+        try:
+            with self.handle.transact():
+                process = psutil.Process(int(job))
+                for proc in process.children(recursive=True) + [process]:
+                    try:
+                        proc.kill()
+                    except psutil.NoSuchProcess:
+                        pass
+            if process.ppid() == os.getpid():
+                process.wait(1)  # reap it
+        except (psutil.NoSuchProcess, psutil.TimeoutExpired):
+            pass  # already gone, or exiting
+
+
+def make_manager(directory, result_ttl):
+    """Background callback manager storing the jobs' results under directory.
+
+    Every request gets its own result key; results are kept for result_ttl
+    seconds after being read.
+    """
+    return BackgroundManager(
+        BackgroundCache(directory),
+        cache_by=[lambda: uuid.uuid4().hex],
+        expire=result_ttl,
+    )
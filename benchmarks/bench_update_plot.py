@@ -0,0 +1,255 @@
+"""Benchmark of the plot callbacks on synthetic data.
+
+Times the callback pipeline end to end and per stage (load, aggregate, figure
+build, JSON serialization) over representative dropdown combinations, with
+the results read from the CSVs and from the converted store, and writes
+p50/p95 latencies and peak memory to a JSON file:
+
+    python benchmarks/bench_update_plot.py --rows 960000 --output bench.json
+    python benchmarks/bench_update_plot.py --compare bench.json
+
+--data-dir is a scratch directory: synthetic CSVs are generated into it if it
+has none, and its converted store is rebuilt or deleted between backends. A
+directory with results not generated by benchmarks/synthetic.py is refused.
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+combinations = {
+    "default": dict(
+        selected_activity="walking",
+        pa_duration="all",
+        noise="all",
+        max_netiob=3,
+        averaging="Weighted",
+        min_glucose=70,
+        max_glucose=250,
+    ),
+    "single-noise": dict(
+        selected_activity="strength training",
+        pa_duration=60,
+        noise="nonoise",
+        max_netiob=1,
+        averaging="Weighted",
+        min_glucose=110,
+        max_glucose=190,
+    ),
+    "narrow": dict(
+        selected_activity="biking",
+        pa_duration=30,
+        noise="fullnoise",
+        max_netiob=0,
+        averaging="Weighted",
+        min_glucose=150,
+        max_glucose=150,
+    ),
+}
+axes = ("%TIR (70-180 mg/dl)", "%TBR (<70 mg/dl)")
+window = ("activity_start", "3hr_after")
+
+
+def data_inputs(combination):
+    from weighting import DEFAULT_WEIGHTING
+
+    c = combination
+    return [
+        c["selected_activity"],
+        c["pa_duration"],
+        c["noise"],
+        c["max_netiob"],
+        c["averaging"],
+        c["min_glucose"],
+        c["max_glucose"],
+        *window,
+        *DEFAULT_WEIGHTING,
+        None,  # facet
+    ]
+
+
+def summarize(times):
+    times = np.array(times) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(times, 50)), 3),
+        "p95_ms": round(float(np.percentile(times, 95)), 3),
+        "mean_ms": round(float(times.mean()), 3),
+        "n": len(times),
+    }
+
+
+def timeit(fn, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return summarize(times)
+
+
+def peak_memory(fn, setup=None):
+    """Peak bytes allocated by Python/NumPy while running fn."""
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def run_backend(repeat):
+    import datasets
+    import my_app
+    import pipeline
+    from figure_cache import figure_cache
+    from figures import build_figure, figure_json
+
+    if my_app.prewarm_thread is not None:
+        my_app.prewarm_thread.join()  # not to overlap the timings
+
+    def clear_aggregates():
+        pipeline.aggregate_cache.clear()
+        figure_cache.clear()
+
+    def clear_all():
+        clear_aggregates()
+        datasets.data_cache.clear()
+
+    results = {}
+    for name, combination in combinations.items():
+        for averaging in ("Weighted", "Unweighted"):
+            inputs = data_inputs({**combination, "averaging": averaging})
+            noise = combination["noise"]
+
+            def load():
+                if datasets.get_cube(noise, *window) is None:
+                    datasets.get_dataset(noise, *window)
+
+            def update():
+                aggregate = my_app.update_aggregate(*inputs)
+                my_app.update_plot(aggregate, *axes)
+
+            clear_all()
+            update()  # warm the dataset caches
+            df_avg = pipeline.aggregate_results(*inputs)
+            fig = build_figure(df_avg, inputs[0], *axes)
+            results[f"{name}/{averaging}"] = {
+                "load": timeit(load, repeat, setup=clear_all),
+                "aggregate": timeit(
+                    lambda: pipeline.aggregate_results(*inputs), repeat
+                ),
+                "figure": timeit(
+                    lambda: build_figure(df_avg, inputs[0], *axes), repeat
+                ),
+                "serialize": timeit(lambda: figure_json(fig), repeat),
+                "end_to_end": timeit(update, repeat, setup=clear_aggregates),
+                "end_to_end_cold": timeit(update, repeat, setup=clear_all),
+                "peak_memory_bytes": peak_memory(update, setup=clear_all),
+            }
+            print(
+                f"{name}/{averaging}: "
+                f"{results[f'{name}/{averaging}']['end_to_end']['p50_ms']} ms warm, "
+                f"{results[f'{name}/{averaging}']['end_to_end_cold']['p50_ms']} ms cold"
+            )
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new):
+    """Print the p50 ratio new/old of every stage present in both runs."""
+    for backend, combos in new["backends"].items():
+        for combo, stages in combos.items():
+            old_stages = old["backends"].get(backend, {}).get(combo)
+            if old_stages is None:
+                continue
+            for stage, result in stages.items():
+                if stage in old_stages and isinstance(result, dict):
+                    before, after = old_stages[stage]["p50_ms"], result["p50_ms"]
+                    ratio = after / before if before else float("nan")
+                    print(
+                        f"{backend:5} {combo:24} {stage:16} "
+                        f"{before:10.2f} -> {after:10.2f} ms  x{ratio:.2f}"
+                    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--data-dir", default=os.path.join(tempfile.gettempdir(), "t1d-pa-bench")
+    )
+    parser.add_argument("--rows", type=int, default=96_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--backend", choices=["csv", "store", "both"], default="both")
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--compare", help="earlier output to compare against")
+    args = parser.parse_args(argv)
+
+    # configure the app modules before they are imported
+    os.environ["DATA_DIR"] = args.data_dir
+    os.environ["FIGURE_CACHE_DIR"] = tempfile.mkdtemp(prefix="t1d-pa-bench-figures")
+    from benchmarks.synthetic import is_synthetic, write_datasets
+    from config import STORE_DIR, results_csv_path
+
+    if glob.glob(os.path.join(args.data_dir, "*.csv")) and not is_synthetic(
+        args.data_dir
+    ):
+        parser.error(
+            f"{args.data_dir} holds results not generated by benchmarks/synthetic.py"
+        )
+    if not os.path.exists(results_csv_path("nonoise", *window)):
+        print(f"generating {args.rows} synthetic rows in {args.data_dir}")
+        write_datasets(args.data_dir, args.rows, windows=[window])
+
+    import store
+
+    report = {
+        "commit": git_commit(),
+        "data_dir": args.data_dir,
+        "rows_per_file": sum(1 for _ in open(results_csv_path("nonoise", *window))),
+        "backends": {},
+    }
+    backends = ["csv", "store"] if args.backend == "both" else [args.backend]
+    for backend in backends:
+        shutil.rmtree(STORE_DIR, ignore_errors=True)
+        if backend == "store":
+            store.ingest()
+        print(f"backend: {backend}")
+        report["backends"][backend] = run_backend(args.repeat)
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    print(f"wrote {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,601 @@
+"""Load test of the app under gunicorn with many concurrent users.
+
+Starts ``gunicorn my_app:server`` on synthetic data and lets simulated users
+drive it the way the Dash renderer does. Each user opens the app (page,
+layout, dependencies and the initial callbacks), then changes one dropdown at
+a time with a random think time in between and re-opens the app after
+--actions changes. Every change POSTs the callbacks it triggers to
+``/_dash-update-component``, and then the callbacks that depend on their
+outputs, including the polling of background callbacks and the
+If-None-Match of assets/etag.js.
+
+    python benchmarks/load_test.py --clients 10 50 --workers 1 2 4 --threads 1 4
+
+Each combination of --workers, --threads and --clients gets its own server
+and a fresh figure cache. The report gives the throughput, the p50/p95/p99
+latency of requests, of each callback (polling included) and of whole
+dropdown changes, the error rate, and the RSS/PSS of the gunicorn master and
+every worker sampled over the run (background jobs summed per worker). The
+server inherits the environment, so settings such as BACKGROUND_CALLBACKS=1
+or PRELOAD_DATASETS=1 apply to it. --data-dir is a scratch directory like
+the one of bench_update_plot.py; directories with real results are refused.
+"""
+
+import argparse
+import collections
+import glob
+import gzip
+import http.client
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    import brotli
+except ImportError:  # optional, responses are then requested with gzip only
+    brotli = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_update_plot import git_commit  # noqa: E402
+from memory import child_pids, pss_bytes, rss_bytes  # noqa: E402
+
+ETAG_ENTRIES = 32  # as kept by assets/etag.js
+# controls changed together, as a user picks a valid combination of them
+window_controls = ("eval-start-dropdown", "eval-end-dropdown")
+glucose_controls = ("min-glucose-dropdown", "max-glucose-dropdown")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentiles(times):
+    if not times:
+        return {"n": 0}
+    times = np.array(times) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(times, 50)), 1),
+        "p95_ms": round(float(np.percentile(times, 95)), 1),
+        "p99_ms": round(float(np.percentile(times, 99)), 1),
+        "n": len(times),
+    }
+
+
+def split_output(output):
+    """["id.property", ...] of a dependency's output string."""
+    if output.startswith(".."):
+        return output[2:-2].split("...")
+    return [output]
+
+
+def prop_spec(prop_id):
+    component, prop = prop_id.rsplit(".", 1)
+    return {"id": component, "property": prop}
+
+
+class Results:
+    """Latencies and errors recorded by all users of a run."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []
+        self.callbacks = collections.defaultdict(list)
+        self.actions = []
+        self.errors = collections.Counter()
+        self.n_requests = 0
+        self.n_actions = 0
+
+    def request(self, seconds, error=None):
+        with self.lock:
+            self.n_requests += 1
+            if error is None:
+                self.requests.append(seconds)
+            else:
+                self.errors[error] += 1
+
+    def error(self, kind):
+        with self.lock:
+            self.errors[kind] += 1
+
+    def callback(self, output, seconds):
+        with self.lock:
+            self.callbacks[output].append(seconds)
+
+    def action(self, seconds, ok):
+        with self.lock:
+            self.n_actions += 1
+            if ok:
+                self.actions.append(seconds)
+
+
+class CallbackError(Exception):
+    pass
+
+
+class User:
+    """One browser session: the component values, ETags and a connection per thread."""
+
+    def __init__(self, host, port, results, rng, timeout, windows):
+        self.host, self.port = host, port
+        self.results = results
+        self.rng = rng
+        self.timeout = timeout
+        self.windows = windows
+        self.local = threading.local()
+        self.etags = collections.OrderedDict()
+        # the renderer runs independent callbacks concurrently
+        self.pool = ThreadPoolExecutor(4)
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = http.client.HTTPConnection(
+                self.host, self.port, timeout=self.timeout
+            )
+            self.local.conn = conn
+        return conn
+
+    def request(self, method, path, body=None):
+        """(status, decoded body) of one request; recorded in the results."""
+        headers = {"Accept-Encoding": "gzip, br" if brotli else "gzip"}
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+            kept = self.etags.get((path, body))
+            if kept is not None:
+                headers["If-None-Match"] = kept[0]
+        start = time.perf_counter()
+        for attempt in range(2):
+            reused = getattr(self.local, "conn", None) is not None
+            try:
+                conn = self.connection()
+                conn.request(method, path, body=body, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+                break
+            except (OSError, http.client.HTTPException) as e:
+                self.local.conn = None
+                conn.close()
+                if reused and attempt == 0:
+                    # the server closed the idle keep-alive connection; browsers
+                    # retry on a new one too
+                    continue
+                self.results.request(time.perf_counter() - start, type(e).__name__)
+                raise CallbackError(f"{path}: {e!r}") from e
+        seconds = time.perf_counter() - start
+        if response.status not in (200, 204, 304):
+            self.results.request(seconds, f"HTTP {response.status}")
+            raise CallbackError(f"{path}: HTTP {response.status}")
+        self.results.request(seconds)
+        encoding = response.getheader("Content-Encoding")
+        if encoding == "gzip":
+            data = gzip.decompress(data)
+        elif encoding == "br":
+            data = brotli.decompress(data)
+        if response.status == 304:
+            data = self.etags[path, body][1]
+        elif body is not None and response.getheader("ETag"):
+            self.etags[path, body] = (response.getheader("ETag"), data)
+            self.etags.move_to_end((path, body))
+            if len(self.etags) > ETAG_ENTRIES:
+                self.etags.popitem(last=False)
+        return response.status, data
+
+    def open_app(self):
+        """Load the page like a new browser tab; returns the initial callbacks."""
+        self.request("GET", "/")
+        layout = json.loads(self.request("GET", "/_dash-layout")[1])
+        self.dependencies = json.loads(self.request("GET", "/_dash-dependencies")[1])
+        self.values = {}
+        self.options = {}
+        stack = [layout]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                props = node.get("props", {})
+                if isinstance(props, dict) and isinstance(props.get("id"), str):
+                    for prop, value in props.items():
+                        self.values[f"{props['id']}.{prop}"] = value
+                    if node.get("type") == "Dropdown" and props.get("options"):
+                        self.options[props["id"]] = [
+                            o["value"] if isinstance(o, dict) else o
+                            for o in props["options"]
+                        ]
+                stack.extend(node.values())
+            elif isinstance(node, list):
+                stack.extend(node)
+        return [d for d in self.dependencies if not d.get("prevent_initial_call")]
+
+    def changes(self):
+        """A random dropdown change, as {"id.value": value}."""
+        enabled = [
+            component
+            for component in self.options
+            if not self.values.get(f"{component}.disabled")
+        ]
+        component = self.rng.choice(enabled)
+        if component in window_controls:
+            components, values = window_controls, self.rng.choice(self.windows)
+        elif component in glucose_controls:
+            values = sorted(self.rng.sample(self.options[component], 2))
+            components = glucose_controls
+        else:
+            current = self.values.get(f"{component}.value")
+            choices = [v for v in self.options[component] if v != current]
+            components, values = [component], [self.rng.choice(choices or [current])]
+        return {f"{c}.value": v for c, v in zip(components, values)}
+
+    def fire(self, dependency, changed):
+        """Run one callback, polling it if it runs in the background."""
+        start = time.perf_counter()
+        outputs = split_output(dependency["output"])
+        specs = [prop_spec(o) for o in outputs]
+
+        def values(props):
+            return [
+                {
+                    "id": p["id"],
+                    "property": p["property"],
+                    "value": self.values.get(f"{p['id']}.{p['property']}"),
+                }
+                for p in props
+            ]
+
+        inputs = values(dependency["inputs"])
+        body = {
+            "output": dependency["output"],
+            "outputs": specs if dependency["output"].startswith("..") else specs[0],
+            "inputs": inputs,
+            "changedPropIds": [
+                f"{i['id']}.{i['property']}"
+                for i in inputs
+                if f"{i['id']}.{i['property']}" in changed
+            ],
+            "state": values(dependency.get("state", [])),
+        }
+        body = json.dumps(body)
+        path = "/_dash-update-component"
+        status, data = self.request("POST", path, body)
+        background = dependency.get("background")
+        response = json.loads(data) if status == 200 else {}
+        if background and "cacheKey" in response:
+            poll = f"{path}?cacheKey={response['cacheKey']}&job={response['job']}"
+            while "response" not in response:
+                if time.perf_counter() - start > self.timeout:
+                    self.results.error("background timeout")
+                    raise CallbackError(f"{poll}: no result in {self.timeout} s")
+                time.sleep(background.get("interval", 1000) / 1000)
+                status, data = self.request("POST", poll, body)
+                if status == 204:
+                    # the job ended without storing a result; users never
+                    # cancel jobs here, so it was lost
+                    self.results.error("background result lost")
+                    raise CallbackError(f"{poll}: no result")
+                response = json.loads(data)
+        self.results.callback(dependency["output"], time.perf_counter() - start)
+        updated = {}  # nothing on a PreventUpdate or a 304
+        for component, props in response.get("response", {}).items():
+            for prop, value in props.items():
+                updated[f"{component}.{prop}"] = value
+        return updated
+
+    def run_callbacks(self, pending, changed):
+        """Run the pending callbacks and those triggered by their outputs.
+
+        A callback waits while another pending callback outputs one of its
+        inputs, as in the renderer; ready callbacks run concurrently.
+        """
+        changed = set(changed)
+        while pending:
+            blocked = set()
+            for d in pending:
+                blocked.update(split_output(d["output"]))
+            ready = [
+                d
+                for d in pending
+                if not any(
+                    f"{i['id']}.{i['property']}" in blocked
+                    and f"{i['id']}.{i['property']}" not in split_output(d["output"])
+                    for i in d["inputs"]
+                )
+            ]
+            if not ready:  # a cycle; shouldn't happen in a Dash app
+                ready = pending[:1]
+            updates = list(self.pool.map(lambda d: self.fire(d, changed), ready))
+            new = set()
+            for update in updates:
+                self.values.update(update)
+                new.update(update)
+            changed |= new
+            pending = [d for d in pending if d not in ready]
+            for d in self.dependencies:
+                inputs = {f"{i['id']}.{i['property']}" for i in d["inputs"]}
+                if inputs & new and d not in pending:
+                    pending.append(d)
+
+    def action(self, pending, changed=()):
+        start = time.perf_counter()
+        try:
+            self.run_callbacks(pending, changed)
+        except CallbackError:
+            self.results.action(time.perf_counter() - start, ok=False)
+            return
+        self.results.action(time.perf_counter() - start, ok=True)
+
+    def run(self, deadline, actions, think_time):
+        while time.time() < deadline:
+            try:
+                initial = self.open_app()
+            except CallbackError:
+                time.sleep(1)
+                continue
+            self.action(initial)
+            for _ in range(actions):
+                if time.time() >= deadline:
+                    break
+                if think_time:
+                    time.sleep(self.rng.expovariate(1 / think_time))
+                changes = self.changes()
+                self.values.update(changes)
+                triggered = [
+                    d
+                    for d in self.dependencies
+                    if any(f"{i['id']}.{i['property']}" in changes for i in d["inputs"])
+                ]
+                self.action(triggered, changes)
+        self.pool.shutdown()
+
+
+class MemorySampler(threading.Thread):
+    """Samples the RSS and PSS of the gunicorn master and its workers."""
+
+    def __init__(self, master, interval):
+        super().__init__(daemon=True)
+        self.master = master
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.samples = collections.defaultdict(list)  # pid -> [(rss, pss, jobs)]
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            for pid in [self.master] + child_pids(self.master):
+                rss = rss_bytes(pid)
+                if rss is None:
+                    continue  # exited
+                jobs = sum(rss_bytes(job) or 0 for job in child_pids(pid))
+                self.samples[pid].append((rss, pss_bytes(pid) or 0, jobs))
+
+    def report(self):
+        processes = {}
+        for pid, samples in self.samples.items():
+            rss, pss, jobs = (np.array(x) / 2**20 for x in zip(*samples))
+            name = "master" if pid == self.master else f"worker {pid}"
+            processes[name] = {
+                "rss_mb_mean": round(float(rss.mean()), 1),
+                "rss_mb_peak": round(float(rss.max()), 1),
+                "pss_mb_peak": round(float(pss.max()), 1),
+                "background_jobs_rss_mb_peak": round(float(jobs.max()), 1),
+            }
+        return processes
+
+
+def start_server(port, workers, threads, env, log):
+    command = [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "my_app:server",
+        f"--bind=127.0.0.1:{port}",
+        f"--workers={workers}",
+        f"--threads={threads}",
+        "--timeout=300",
+    ]
+    server = subprocess.Popen(
+        command, cwd=ROOT, env=env, stdout=log, stderr=log, start_new_session=True
+    )
+    deadline = time.time() + 300
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(
+                f"gunicorn exited with {server.returncode}; see {log.name}"
+            )
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/_dash-dependencies")
+            if conn.getresponse().status == 200:
+                return server
+        except OSError:
+            pass
+        time.sleep(0.2)
+    stop_server(server)
+    raise RuntimeError(f"gunicorn did not start in time; see {log.name}")
+
+
+def stop_server(server):
+    # the workers' background jobs are in the same session
+    try:
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait(30)
+    except subprocess.TimeoutExpired:
+        os.killpg(server.pid, signal.SIGKILL)
+        server.wait()
+    except ProcessLookupError:
+        pass
+
+
+def run_load(args, workers, threads, clients, windows, log):
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATA_DIR=args.data_dir,
+        FIGURE_CACHE_DIR=tempfile.mkdtemp(prefix="t1d-pa-load-figures"),
+        BACKGROUND_CACHE_DIR=tempfile.mkdtemp(prefix="t1d-pa-load-background"),
+    )
+    server = start_server(port, workers, threads, env, log)
+    sampler = MemorySampler(server.pid, args.sample_interval)
+    results = Results()
+    try:
+        sampler.start()
+        deadline = time.time() + args.duration
+        users = [
+            User(
+                "127.0.0.1",
+                port,
+                results,
+                random.Random(args.seed * 100_003 + i),
+                args.timeout,
+                windows,
+            )
+            for i in range(clients)
+        ]
+        user_threads = [
+            threading.Thread(
+                target=user.run, args=(deadline, args.actions, args.think_time)
+            )
+            for user in users
+        ]
+        start = time.perf_counter()
+        for thread in user_threads:
+            thread.start()
+            if args.ramp_up:
+                time.sleep(args.ramp_up / clients)
+        for thread in user_threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        sampler.stopped.set()
+        sampler.join()
+        stop_server(server)
+        shutil.rmtree(env["FIGURE_CACHE_DIR"], ignore_errors=True)
+        shutil.rmtree(env["BACKGROUND_CACHE_DIR"], ignore_errors=True)
+    n_errors = sum(results.errors.values())
+    return {
+        "workers": workers,
+        "threads": threads,
+        "clients": clients,
+        "seconds": round(elapsed, 1),
+        "requests": results.n_requests,
+        "requests_per_s": round(results.n_requests / elapsed, 1),
+        "actions": results.n_actions,
+        "actions_per_s": round(results.n_actions / elapsed, 2),
+        "error_rate": round(n_errors / max(results.n_requests, 1), 4),
+        "errors": dict(results.errors),
+        "latency": {
+            "request": percentiles(results.requests),
+            "action": percentiles(results.actions),
+            **{
+                f"callback {output}": percentiles(times)
+                for output, times in sorted(results.callbacks.items())
+            },
+        },
+        "memory": sampler.report(),
+    }
+
+
+def print_run(run):
+    action, request = run["latency"]["action"], run["latency"]["request"]
+    workers = [p for name, p in run["memory"].items() if name != "master"]
+    print(
+        f"workers={run['workers']} threads={run['threads']} clients={run['clients']}: "
+        f"{run['requests_per_s']} req/s, {run['actions_per_s']} changes/s, "
+        f"errors {run['error_rate']:.2%}\n"
+        f"  request p50/p95/p99 {request.get('p50_ms')}/{request.get('p95_ms')}/"
+        f"{request.get('p99_ms')} ms, "
+        f"change p50/p95/p99 {action.get('p50_ms')}/{action.get('p95_ms')}/"
+        f"{action.get('p99_ms')} ms\n"
+        f"  worker RSS peak "
+        + ", ".join(f"{w['rss_mb_peak']:.0f}" for w in workers)
+        + f" MB, master {run['memory'].get('master', {}).get('rss_mb_peak')} MB"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--data-dir", default=os.path.join(tempfile.gettempdir(), "t1d-pa-load")
+    )
+    parser.add_argument("--rows", type=int, default=96_000)
+    parser.add_argument("--backend", choices=["csv", "store"], default="store")
+    parser.add_argument("--clients", type=int, nargs="+", default=[50])
+    parser.add_argument("--workers", type=int, nargs="+", default=[2])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1])
+    parser.add_argument("--duration", type=float, default=60, help="seconds per run")
+    parser.add_argument(
+        "--think-time", type=float, default=2.0, help="mean seconds between changes"
+    )
+    parser.add_argument(
+        "--actions", type=int, default=10, help="changes before re-opening the app"
+    )
+    parser.add_argument(
+        "--ramp-up", type=float, default=0, help="seconds over which users arrive"
+    )
+    parser.add_argument("--timeout", type=float, default=120, help="request timeout")
+    parser.add_argument("--sample-interval", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="load_test.json")
+    args = parser.parse_args(argv)
+    # stop the server on a SIGTERM too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+
+    # configure the app modules before they are imported
+    os.environ["DATA_DIR"] = args.data_dir
+    from benchmarks.synthetic import eval_windows, is_synthetic, write_datasets
+    from config import STORE_DIR, results_csv_path
+
+    if glob.glob(os.path.join(args.data_dir, "*.csv")) and not is_synthetic(
+        args.data_dir
+    ):
+        parser.error(
+            f"{args.data_dir} holds results not generated by benchmarks/synthetic.py"
+        )
+
+    windows = eval_windows()
+    if not all(os.path.exists(results_csv_path("nonoise", *w)) for w in windows):
+        print(f"generating {args.rows} synthetic rows per window in {args.data_dir}")
+        write_datasets(args.data_dir, args.rows, windows=windows)
+    if args.backend == "store":
+        import store
+
+        store.ingest()
+    else:
+        shutil.rmtree(STORE_DIR, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "data_dir": args.data_dir,
+        "backend": args.backend,
+        "settings": {
+            k: getattr(args, k)
+            for k in ("duration", "think_time", "actions", "ramp_up", "seed")
+        },
+        "runs": [],
+    }
+    log_path = os.path.splitext(args.output)[0] + ".log"
+    with open(log_path, "w") as log:
+        for workers in args.workers:
+            for threads in args.threads:
+                for clients in args.clients:
+                    run = run_load(args, workers, threads, clients, windows, log)
+                    print_run(run)
+                    report["runs"].append(run)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    print(f"wrote {args.output} (server log in {log_path})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Synthetic simulation results with the same layout as the real ./data CSVs.
+
+The real results are not shipped with the repository. This writes one CSV per
+noise level and evaluation window with the columns of config.col_names, over
+the simulation grid described in the README (starting glucose 70-250, netIoB
+0-3, 30/60 min, four activities, 20 presets, five targets). Larger datasets
+repeat the grid for more virtual patients (vp_index).
+
+    python benchmarks/synthetic.py --data-dir /tmp/t1d-data --rows 960000
+"""
+
+import argparse
+import itertools
+import math
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import RESULTS_PREFIX, col_names, eval_ends, eval_starts, noise_levels
+
+starting_glucoses = list(range(70, 260, 20))
+netiobs = [0, 1, 2, 3]
+pa_durations = [30, 60]
+activities = [
+    "walking",
+    "biking",
+    "jogging",
+    "rength training",
+]  # typo as in the results
+presets = [round(0.1 * i, 1) for i in range(1, 21)]
+target_mins = [100, 120, 140, 150, 160]
+grid_size = (
+    len(starting_glucoses)
+    * len(netiobs)
+    * len(pa_durations)
+    * len(activities)
+    * len(presets)
+    * len(target_mins)
+)  # simulations per virtual patient and noise level
+
+default_window = ("activity_start", "3hr_after")
+
+# written into every directory write_datasets generates; the benchmarks
+# rebuild and delete the store of such directories only
+MARKER_FILE = ".synthetic"
+
+
+def eval_windows():
+    """Every (eval_start, eval_end) with the start before the end."""
+    order = ["1hr_before", "activity_start", "activity_end"] + eval_ends[2:]
+    return [
+        (start, end)
+        for start, end in itertools.product(eval_starts, eval_ends)
+        if order.index(start) < order.index(end)
+    ]
+
+
+def is_synthetic(data_dir):
+    """True if data_dir was generated by write_datasets."""
+    return os.path.exists(os.path.join(data_dir, MARKER_FILE))
+
+
+def make_results(n_patients, noise, rng):
+    """Results frame of n_patients virtual patients for one noise level."""
+    grid = np.array(
+        list(
+            itertools.product(
+                starting_glucoses,
+                netiobs,
+                pa_durations,
+                range(len(activities)),
+                presets,
+                target_mins,
+            )
+        )
+    )
+    grid = np.tile(grid, (n_patients, 1))
+    n = len(grid)
+    glucose, netiob, duration, activity, preset, target_min = grid.T
+    # lower presets and higher targets reduce insulin, shifting time below range
+    # to time above range; the noise adds patient-to-patient spread
+    risk = (
+        (1.2 - preset) * 10 + (target_min - 100) / 10 - (glucose - 70) / 30 + netiob * 3
+    )
+    tbr70 = np.clip(rng.normal(5 - risk / 4, 2, n), 0, 100)
+    tbr54 = tbr70 * rng.uniform(0, 0.5, n)
+    tar = np.clip(rng.normal(20 + risk, 8, n), 0, 100 - tbr70)
+    tar250 = tar * rng.uniform(0, 0.4, n)
+    lbgi = np.abs(rng.normal(tbr70 / 3, 0.5, n))
+    hbgi = np.abs(rng.normal(tar / 4, 1, n))
+    df = pd.DataFrame(
+        {
+            "sim_condition": np.arange(n),
+            "starting_glucose": glucose.astype(int),
+            "netIoB": netiob.astype(int),
+            "pa_duration": duration.astype(int),
+            "activity": np.array(activities)[activity.astype(int)],
+            "preset": preset,
+            "target_min": target_min.astype(int),
+            "target_max": target_min.astype(int) + 20,
+            "vp_index": np.repeat(np.arange(n_patients), grid_size),
+            "noise_condition": noise,
+            "del_g": rng.normal(0, 30, n),
+            "LBGI": lbgi,
+            "HBGI": hbgi,
+            "BGRI": lbgi + hbgi,
+            "%TBR (<54 mg/dl)": tbr54,
+            "%TBR (<54-<70 mg/dl)": tbr70 - tbr54,
+            "%TBR (<70 mg/dl)": tbr70,
+            "%TIR (70-180 mg/dl)": 100 - tbr70 - tar,
+            "%TAR (>180 mg/dl)": tar,
+            "%TAR (>180-<=250 mg/dl)": tar - tar250,
+            "%TAR (>=250 mg/dl)": tar250,
+            "basal": rng.uniform(0, 5, n),
+            "bolus": rng.uniform(0, 10, n),
+            "Magni Risk": np.abs(rng.normal(risk, 3, n)),
+        }
+    )
+    return df[col_names]
+
+
+def write_datasets(data_dir, rows=96_000, windows=(default_window,), seed=0):
+    """Write results CSVs with about `rows` simulations per evaluation window.
+
+    The rows are split over the three noise levels and rounded up to whole
+    virtual patients. Returns the number of rows per file.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    with open(os.path.join(data_dir, MARKER_FILE), "w"):
+        pass
+    n_patients = max(1, math.ceil(rows / len(noise_levels) / grid_size))
+    rng = np.random.default_rng(seed)
+    for eval_start, eval_end in windows:
+        for noise in noise_levels:
+            df = make_results(n_patients, noise, rng)
+            path = os.path.join(
+                data_dir, f"{RESULTS_PREFIX}_{noise}_{eval_start}_{eval_end}.csv"
+            )
+            df.to_csv(path, header=False, index=False)
+    return n_patients * grid_size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data-dir", required=True)
+    parser.add_argument(
+        "--rows",
+        type=int,
+        default=96_000,
+        help="simulations per evaluation window, over all noise levels",
+    )
+    parser.add_argument(
+        "--all-windows",
+        action="store_true",
+        help="write every evaluation window instead of only the default one",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    windows = eval_windows() if args.all_windows else [default_window]
+    n = write_datasets(args.data_dir, args.rows, windows, args.seed)
+    print(
+        f"wrote {len(windows) * len(noise_levels)} files of {n} rows to {args.data_dir}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Sorted layout of the results with an index of block offsets.
+
+Datasets are kept sorted by sort_keys, so the rows of every combination of
+key values form one contiguous block. The index holds the sorted distinct
+values of each key and, per block, its combined key code and first row.
+The app's filters (one or all activities and durations, netIoB <= max and a
+starting glucose range) then select a few contiguous row ranges, found by
+binary search over the blocks instead of masking every row.
+"""
+
+import numpy as np
+import pandas as pd
+
+sort_keys = [
+    "activity",
+    "pa_duration",
+    "netIoB",
+    "starting_glucose",
+    "target_min",
+    "preset",
+]
+INDEX_FILE = "index.npz"
+
+
+def key_codes(df):
+    """Sorted distinct values of each sort key and the combined key of each row."""
+    levels = {}
+    code = np.zeros(len(df), dtype=np.int64)
+    for name in sort_keys:
+        codes, uniques = pd.factorize(df[name], sort=True)
+        uniques = np.asarray(uniques)
+        if uniques.dtype == object:
+            uniques = uniques.astype(str)  # saved without pickling
+        levels[name] = uniques
+        code = code * len(uniques) + codes
+    return levels, code
+
+
+def sort_results(df):
+    """df sorted by sort_keys, and its BlockIndex."""
+    levels, code = key_codes(df)
+    if len(code) and (np.diff(code) < 0).any():
+        order = np.argsort(code, kind="stable")
+        df = df.take(order).reset_index(drop=True)
+        code = code[order]
+    return df, BlockIndex.from_codes(levels, code)
+
+
+class BlockIndex:
+    def __init__(self, levels, block_keys, offsets):
+        self.levels = levels  # sort key -> sorted distinct values
+        self.block_keys = block_keys  # combined key code of each block
+        self.offsets = offsets  # first row of each block, and the row count
+
+    @property
+    def nbytes(self):
+        return self.block_keys.nbytes + self.offsets.nbytes
+
+    @classmethod
+    def from_codes(cls, levels, code):
+        block_keys, starts = np.unique(code, return_index=True)
+        offsets = np.append(starts, len(code)).astype(np.int64)
+        return cls(levels, block_keys, offsets)
+
+    @classmethod
+    def from_frame(cls, df):
+        """Index of a frame already sorted by sort_keys."""
+        return cls.from_codes(*key_codes(df))
+
+    def save(self, path):
+        np.savez(
+            path,
+            block_keys=self.block_keys,
+            offsets=self.offsets,
+            **{f"level_{name}": self.levels[name] for name in sort_keys},
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            levels = {name: f[f"level_{name}"] for name in sort_keys}
+            return cls(levels, f["block_keys"], f["offsets"])
+
+    def slices(self, activity, pa_duration, max_netiob, min_glucose, max_glucose):
+        """(start, stop) row ranges of the rows matching the filters."""
+        levels = self.levels
+        if activity == "all":
+            a = np.arange(len(levels["activity"]))
+        else:
+            a = np.flatnonzero(levels["activity"] == activity)
+        if pa_duration == "all":
+            d = np.arange(len(levels["pa_duration"]))
+        else:
+            d = np.flatnonzero(levels["pa_duration"] == pa_duration)
+        n = np.arange(np.searchsorted(levels["netIoB"], max_netiob, side="right"))
+        glucose = levels["starting_glucose"]
+        g_lo = np.searchsorted(glucose, min_glucose, side="left")
+        g_hi = np.searchsorted(glucose, max_glucose, side="right") - 1
+        if len(a) == 0 or len(d) == 0 or len(n) == 0 or g_hi < g_lo:
+            return []
+        # one key range per (activity, pa_duration, netIoB): the glucose range
+        # over all targets and presets
+        shape = tuple(len(levels[name]) for name in sort_keys)
+        a, d, n = (x.ravel() for x in np.meshgrid(a, d, n, indexing="ij"))
+        key_lo = np.ravel_multi_index((a, d, n, g_lo, 0, 0), shape)
+        key_hi = np.ravel_multi_index(
+            (a, d, n, g_hi, shape[-2] - 1, shape[-1] - 1), shape
+        )
+        starts = self.offsets[np.searchsorted(self.block_keys, key_lo, side="left")]
+        stops = self.offsets[np.searchsorted(self.block_keys, key_hi, side="right")]
+        ranges = []
+        for start, stop in zip(starts.tolist(), stops.tolist()):
+            if start == stop:
+                continue
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], stop)  # merge adjacent ranges
+            else:
+                ranges.append((start, stop))
+        return ranges
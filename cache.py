@@ -0,0 +1,180 @@
+"""In-process LRU caches bounded by a memory budget.
+
+Each cache has its own budget in bytes. With MEMORY_BUDGET_MB set, the app
+as a whole has one too: near it, every cache is emptied (see
+memory_pressure) instead of the instance running out of memory.
+"""
+
+import gc
+import os
+import sys
+import threading
+import weakref
+from collections import OrderedDict
+
+import pandas as pd
+
+from memory import app_memory_bytes, format_mb
+
+# memory budget of the app, all its processes together (see
+# memory.app_memory_bytes), in MB, 0 for none: once their memory reaches
+# SHED_FRACTION of it, the caches of the process that notices are emptied
+MEMORY_BUDGET_MB = float(os.environ.get("MEMORY_BUDGET_MB", 0))
+SHED_FRACTION = 0.8
+
+sheds = 0  # times the caches were emptied to stay under MEMORY_BUDGET_MB
+
+
+def sizeof(value):
+    """Approximate size of a cached value in bytes."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True, index=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True, index=True))
+    nbytes = getattr(value, "nbytes", None)
+    if nbytes is not None:
+        return int(nbytes)
+    return sys.getsizeof(value)
+
+
+_caches = weakref.WeakSet()
+
+
+def _reset_locks():
+    # a process forked while another thread (e.g. the prewarm thread) held a
+    # cache lock would otherwise inherit it locked forever
+    for cache in _caches:
+        cache._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_locks)
+
+
+class LRUCache:
+    """Least-recently-used cache that evicts entries to stay under max_bytes.
+
+    Entries can carry a fingerprint (e.g. the mtime/size of the file they were
+    loaded from); a lookup with a different fingerprint drops the entry.
+    Pinned entries are never evicted and don't count towards max_bytes.
+    """
+
+    def __init__(self, max_bytes, sizeof=sizeof):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (value, fingerprint, size)
+        self._pinned = {}  # key -> (value, fingerprint, size)
+        self._lock = threading.Lock()
+        _caches.add(self)
+
+    def __len__(self):
+        return len(self._entries) + len(self._pinned)
+
+    def __contains__(self, key):
+        return key in self._entries or key in self._pinned
+
+    def get(self, key, fingerprint=None):
+        with self._lock:
+            entry = self._pinned.get(key)
+            if entry is not None:
+                if entry[1] == fingerprint:
+                    self.hits += 1
+                    return entry[0]
+                del self._pinned[key]
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] != fingerprint:
+                self._remove(key)  # source changed since the entry was cached
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, fingerprint=None, pinned=False):
+        size = self.sizeof(value)
+        with self._lock:
+            self._pinned.pop(key, None)
+            if key in self._entries:
+                self._remove(key)
+            if pinned:
+                self._pinned[key] = (value, fingerprint, size)
+                return value
+            if size > self.max_bytes:
+                return value  # would evict everything else; don't cache
+            self._entries[key] = (value, fingerprint, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return value
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self.nbytes -= size
+
+    def shed(self):
+        """Drop every entry but the pinned ones; returns the bytes dropped."""
+        with self._lock:
+            dropped = self.nbytes
+            self.evictions += len(self._entries)
+            self._entries.clear()
+            self.nbytes = 0
+        return dropped
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pinned.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.nbytes,
+            "pinned_entries": len(self._pinned),
+            "pinned_bytes": sum(size for _, _, size in self._pinned.values()),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def shed_caches():
+    """Empty every cache but its pinned entries; returns the bytes dropped."""
+    dropped = sum(cache.shed() for cache in list(_caches))
+    if dropped:
+        gc.collect()  # frames in reference cycles would outlive their entries
+    return dropped
+
+
+def memory_pressure():
+    """True if the app is near MEMORY_BUDGET_MB even with empty caches.
+
+    Near the budget the caches of this process are emptied first (every
+    worker empties its own when it notices); callers with a leaner way of
+    doing their work should take it when that did not free enough.
+    """
+    global sheds
+    if not MEMORY_BUDGET_MB:
+        return False
+    limit = SHED_FRACTION * MEMORY_BUDGET_MB * 2**20
+    used = app_memory_bytes()
+    if used is None or used < limit:
+        return False
+    dropped = shed_caches()
+    if not dropped:
+        return True
+    sheds += 1
+    now = app_memory_bytes()
+    print(
+        f"memory budget: dropped {format_mb(dropped)} of cached data at "
+        f"{format_mb(used)} used by the app, now {format_mb(now)}"
+    )
+    return now >= limit
@@ -0,0 +1,103 @@
+import os
+
+col_names = [
+    "sim_condition",
+    "starting_glucose",
+    "netIoB",
+    "pa_duration",
+    "activity",
+    "preset",
+    "target_min",
+    "target_max",
+    "vp_index",
+    "noise_condition",
+    "del_g",
+    "LBGI",
+    "HBGI",
+    "BGRI",
+    "%TBR (<54 mg/dl)",
+    "%TBR (<54-<70 mg/dl)",
+    "%TBR (<70 mg/dl)",
+    "%TIR (70-180 mg/dl)",
+    "%TAR (>180 mg/dl)",
+    "%TAR (>180-<=250 mg/dl)",
+    "%TAR (>=250 mg/dl)",
+    "basal",
+    "bolus",
+    "Magni Risk",
+]  # column names of the dataframes
+
+# compact dtypes of the results columns, plus the "noise" column added on load.
+# Low-cardinality columns are categoricals (preset too, as float32 would change
+# its values), the metrics float32.
+results_schema = {
+    "sim_condition": "category",
+    "starting_glucose": "int16",
+    "netIoB": "int8",
+    "pa_duration": "int16",
+    "activity": "category",
+    "preset": "category",
+    "target_min": "int16",
+    "target_max": "int16",
+    "vp_index": "int32",
+    "noise_condition": "category",
+    "del_g": "float32",
+    "LBGI": "float32",
+    "HBGI": "float32",
+    "BGRI": "float32",
+    "%TBR (<54 mg/dl)": "float32",
+    "%TBR (<54-<70 mg/dl)": "float32",
+    "%TBR (<70 mg/dl)": "float32",
+    "%TIR (70-180 mg/dl)": "float32",
+    "%TAR (>180 mg/dl)": "float32",
+    "%TAR (>180-<=250 mg/dl)": "float32",
+    "%TAR (>=250 mg/dl)": "float32",
+    "basal": "float32",
+    "bolus": "float32",
+    "Magni Risk": "float32",
+    "noise": "category",
+}
+SCHEMA_VERSION = 3  # bump when results_schema or the store layout changes
+
+metrics_list = [
+    "%TIR (70-180 mg/dl)",
+    "%TBR (<54 mg/dl)",
+    "%TBR (<70 mg/dl)",
+    "%TAR (>180 mg/dl)",
+    "LBGI",
+    "HBGI",
+    "BGRI",
+    "Magni Risk",
+]
+
+t1dexi_presets = {
+    "walking": 0.2,
+    "biking": 0.2,
+    "jogging": 0.2,
+    "strength training": 0.4,
+}
+
+# parameters of log-normal t1dexi starting glucose distribution
+mu = 4.93
+sigma = 0.34
+
+# simulation results are stored as DATA_DIR/03_13_{noise}_{eval_start}_{eval_end}.csv
+DATA_DIR = os.environ.get("DATA_DIR", "./data")
+STORE_DIR = os.path.join(DATA_DIR, "store")
+RESULTS_PREFIX = "03_13"
+
+noise_levels = ["nonoise", "samplednoise", "fullnoise"]
+eval_starts = ["1hr_before", "activity_start", "activity_end"]
+eval_ends = ["activity_start", "activity_end", "1hr_after", "2hr_after", "3hr_after"]
+
+
+def dataset_name(noise, eval_start, eval_end):
+    return f"{RESULTS_PREFIX}_{noise}_{eval_start}_{eval_end}"
+
+
+def results_csv_path(noise, eval_start, eval_end):
+    return os.path.join(DATA_DIR, dataset_name(noise, eval_start, eval_end) + ".csv")
+
+
+def dataset_store_path(noise, eval_start, eval_end):
+    return os.path.join(STORE_DIR, dataset_name(noise, eval_start, eval_end))
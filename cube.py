@@ -0,0 +1,260 @@
+"""Pre-aggregated metric sums over the discrete simulation grid.
+
+Every filter in the app selects cells of the grid activity x pa_duration x
+netIoB x starting_glucose x target_min x preset. The cube stores, per cell
+and metric, the weighted and the plain sum (float32), and per cell the sum
+of weights and the count of the simulations (int32). Metrics with missing
+values get a weight sum and count of their own, over their non-NaN values.
+The sums are cumulative along the netIoB and starting_glucose axes, so a
+"netIoB <= max, min <= glucose <= max" query is two lookups and a
+subtraction, independent of the number of rows.
+Weighted means under another starting glucose weighting difference the
+prefix sums back into glucose cells and weight those at query time.
+"""
+
+import numpy as np
+import pandas as pd
+
+from aggregation import group_sums, intervention_labels
+from config import metrics_list
+from weighting import glucose_weights
+
+axis_names = [
+    "activity",
+    "pa_duration",
+    "netIoB",
+    "starting_glucose",
+    "target_min",
+    "preset",
+]
+NETIOB_AXIS = 2
+GLUCOSE_AXIS = 3
+CUBE_FILE = "cube.npz"
+
+
+def grid_codes(df):
+    """Sorted grid values of each axis and the flat grid cell of each row."""
+    axes = {}
+    codes = []
+    for name in axis_names:
+        key_codes, uniques = pd.factorize(df[name], sort=True)
+        uniques = np.asarray(uniques)
+        if uniques.dtype == object:
+            uniques = uniques.astype(str)  # saved without pickling
+        axes[name] = uniques
+        codes.append(key_codes)
+    shape = tuple(len(axes[name]) for name in axis_names)
+    return axes, codes, np.ravel_multi_index(codes, shape)
+
+
+def prefix_sums(a, shape, dtype):
+    """a per cell, reshaped to the grid and cumulative along netIoB and glucose."""
+    a = a.reshape(shape + (a.shape[-1],))
+    return a.cumsum(axis=NETIOB_AXIS).cumsum(axis=GLUCOSE_AXIS).astype(dtype)
+
+
+class AggregateCube:
+    def __init__(self, axes, target_max, sums, w_sums, raw_sums, counts, count_index):
+        self.axes = axes  # axis name -> sorted grid values
+        self.target_max = target_max  # target_max of each target_min
+        # arrays of shape (*grid shape, n), cumulative along netIoB and
+        # starting_glucose: n_metrics for the sums, and for the weight sums
+        # and counts one column for the metrics without NaN followed by one
+        # per metric with NaN; count_index is the column of each metric
+        self.sums = sums
+        self.w_sums = w_sums
+        self.raw_sums = raw_sums
+        self.counts = counts
+        self.count_index = count_index
+
+    @property
+    def nbytes(self):
+        return sum(
+            a.nbytes for a in (self.sums, self.w_sums, self.raw_sums, self.counts)
+        )
+
+    @classmethod
+    def from_frame(cls, df, metrics=metrics_list, weights=None):
+        if weights is None:
+            weights = glucose_weights(df["starting_glucose"])
+        axes, codes, cell = grid_codes(df)
+        shape = tuple(len(axes[name]) for name in axis_names)
+        n_cells = int(np.prod(shape))
+        values = df[metrics].to_numpy(dtype=np.float64)
+        sums, w_sums = group_sums(values, cell, n_cells, weights)
+        raw_sums, counts = group_sums(values, cell, n_cells)
+        target_max = (
+            pd.Series(np.asarray(df["target_max"]))
+            .groupby(codes[axis_names.index("target_min")])
+            .first()
+            .to_numpy()
+        )
+        nan_metrics = np.flatnonzero(np.isnan(values).any(axis=0))
+        count_index = np.zeros(len(metrics), dtype=np.int64)
+        count_index[nan_metrics] = np.arange(1, len(nan_metrics) + 1)
+        w_sums = np.column_stack(
+            [np.bincount(cell, weights=weights, minlength=n_cells)]
+            + [w_sums[:, j] for j in nan_metrics]
+        )
+        counts = np.column_stack(
+            [np.bincount(cell, minlength=n_cells)] + [counts[:, j] for j in nan_metrics]
+        )
+        return cls(
+            axes,
+            target_max,
+            prefix_sums(sums, shape, np.float32),
+            prefix_sums(w_sums, shape, np.float32),
+            prefix_sums(raw_sums, shape, np.float32),
+            prefix_sums(counts, shape, np.int32),
+            count_index,
+        )
+
+    def save(self, path):
+        np.savez(
+            path,
+            target_max=self.target_max,
+            sums=self.sums,
+            w_sums=self.w_sums,
+            raw_sums=self.raw_sums,
+            counts=self.counts,
+            count_index=self.count_index,
+            **{f"axis_{name}": self.axes[name] for name in axis_names},
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            axes = {name: f[f"axis_{name}"] for name in axis_names}
+            return cls(
+                axes,
+                f["target_max"],
+                f["sums"],
+                f["w_sums"],
+                f["raw_sums"],
+                f["counts"],
+                f["count_index"],
+            )
+
+    def same_grid(self, other):
+        return all(
+            np.array_equal(self.axes[name], other.axes[name]) for name in axis_names
+        )
+
+    def _count_columns(self, nan_metrics):
+        """(w_sums, counts) with the shared column, then one per nan_metrics."""
+        columns = [0] + [self.count_index[j] for j in nan_metrics]
+        return self.w_sums[..., columns], self.counts[..., columns]
+
+    def __add__(self, other):
+        """Combine cubes of the same grid, e.g. the three noise levels."""
+        if not self.same_grid(other):
+            raise ValueError("cubes are built over different grids")
+        nan_metrics = np.flatnonzero((self.count_index > 0) | (other.count_index > 0))
+        count_index = np.zeros(len(self.count_index), dtype=np.int64)
+        count_index[nan_metrics] = np.arange(1, len(nan_metrics) + 1)
+        w_sums, counts = self._count_columns(nan_metrics)
+        other_w_sums, other_counts = other._count_columns(nan_metrics)
+        return AggregateCube(
+            self.axes,
+            self.target_max,
+            self.sums + other.sums,
+            w_sums + other_w_sums,
+            self.raw_sums + other.raw_sums,
+            counts + other_counts,
+            count_index,
+        )
+
+    def _netiob_sums(self, array, activity, pa_duration, max_netiob):
+        """Sums up to max_netiob, per (starting_glucose, target_min, preset, metric).
+
+        Still cumulative along starting_glucose; None if no cell is selected.
+        """
+        a = np.flatnonzero(self.axes["activity"] == activity)
+        n_hi = np.searchsorted(self.axes["netIoB"], max_netiob, side="right") - 1
+        if len(a) == 0 or n_hi < 0:
+            return None
+        sel = array[a[0]]
+        if pa_duration == "all":
+            sel = sel.sum(axis=0)
+        else:
+            d = np.flatnonzero(self.axes["pa_duration"] == pa_duration)
+            if len(d) == 0:
+                return None
+            sel = sel[d[0]]
+        return sel[n_hi]
+
+    def _range_sums(
+        self,
+        array,
+        activity,
+        pa_duration,
+        max_netiob,
+        min_glucose,
+        max_glucose,
+        weights=None,
+    ):
+        """Sums over the selected cells, per (target_min, preset, metric).
+
+        With weights (one per starting_glucose grid value) every glucose cell
+        is multiplied by its weight before summing.
+        """
+        glucose = self.axes["starting_glucose"]
+        g_lo = np.searchsorted(glucose, min_glucose, side="left")
+        g_hi = np.searchsorted(glucose, max_glucose, side="right") - 1
+        sel = self._netiob_sums(array, activity, pa_duration, max_netiob)
+        if sel is None or g_hi < g_lo:
+            return np.zeros(array.shape[-3:])
+        sel = sel[: g_hi + 1].astype(np.float64)
+        if weights is not None:
+            # undo the prefix sum along glucose to weight the cells one by one
+            cells = np.diff(sel, axis=0, prepend=0)[g_lo:]
+            return np.tensordot(weights[g_lo : g_hi + 1], cells, axes=(0, 0))
+        total = sel[g_hi]
+        if g_lo > 0:
+            total = total - sel[g_lo - 1]
+        return total
+
+    def query(
+        self,
+        activity,
+        pa_duration,
+        max_netiob,
+        min_glucose,
+        max_glucose,
+        weighted=True,
+        metrics=metrics_list,
+        weights=None,
+    ):
+        """Per (target_min, preset) means, like group_means on the filtered rows.
+
+        Weighted means use the weights the cube was built with, or weights if
+        given: the weight of each value of axes["starting_glucose"].
+        """
+        args = (activity, pa_duration, max_netiob, min_glucose, max_glucose)
+        if weighted and weights is not None:
+            sums = self._range_sums(self.raw_sums, *args, weights=weights)
+            w_sums = self._range_sums(self.counts, *args, weights=weights)
+        elif weighted:
+            sums = self._range_sums(self.sums, *args)
+            w_sums = self._range_sums(self.w_sums, *args)
+        else:
+            sums = self._range_sums(self.raw_sums, *args)
+            w_sums = self._range_sums(self.counts, *args)
+        # one weight sum and count per metric
+        w_sums = w_sums[..., self.count_index]
+        counts = self._range_sums(self.counts, *args)[..., self.count_index]
+        t, p = np.nonzero(counts.max(axis=-1) > 0.5)  # cells with any simulation
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = np.where(counts[t, p] > 0.5, sums[t, p] / w_sums[t, p], np.nan)
+        target_min = self.axes["target_min"][t]
+        preset = self.axes["preset"][p]
+        columns = {
+            "label": np.asarray(
+                intervention_labels(target_min, self.target_max[t], preset)
+            ),
+            "target_min": target_min,
+            "preset": preset,
+        }
+        columns.update((metric, means[:, j]) for j, metric in enumerate(metrics))
+        df_avg = pd.DataFrame(columns)
+        return df_avg
@@ -0,0 +1,253 @@
+"""Loading of the cleaned results frames used by the app.
+
+Frames are cached per (noise, eval_start, eval_end), the same tuple that
+names the results file, and reloaded when that file changes on disk.
+"""
+
+import gc
+import hashlib
+import itertools
+import os
+
+import numpy as np
+
+from block_index import INDEX_FILE, BlockIndex
+from cache import LRUCache
+from config import (
+    dataset_store_path,
+    eval_ends,
+    eval_starts,
+    noise_levels,
+    results_csv_path,
+)
+from cube import CUBE_FILE, AggregateCube
+from instrumentation import stage
+from memory import format_mb, memory_report
+from sketch import SKETCH_FILE, QuantileSketch
+from store import (
+    META_FILE,
+    concat_results,
+    file_fingerprint,
+    fresh_store_path,
+    load_results,
+)
+
+# memory budget of the cached datasets, block indexes, cubes and sketches
+# together, in MB
+DATASET_CACHE_MB = float(os.environ.get("DATASET_CACHE_MB", 256))
+
+# load every dataset once in the gunicorn master, see gunicorn.conf.py
+PRELOAD_DATASETS = os.environ.get("PRELOAD_DATASETS", "0") == "1"
+
+# keyed by (kind, noise, eval_start, eval_end), kind being "dataset",
+# "index", "cube" or "sketch"
+data_cache = LRUCache(max_bytes=int(DATASET_CACHE_MB * 2**20))
+
+
+def dataset_fingerprint(noise, eval_start, eval_end):
+    """Changes whenever the results CSV or its converted store is rewritten."""
+    return (
+        file_fingerprint(results_csv_path(noise, eval_start, eval_end)),
+        file_fingerprint(
+            os.path.join(dataset_store_path(noise, eval_start, eval_end), META_FILE)
+        ),
+    )
+
+
+def dataset_version(noise, eval_start, eval_end):
+    """Short hash identifying the current contents of the dataset(s)."""
+    levels = noise_levels if noise == "all" else [noise]
+    fingerprints = [
+        dataset_fingerprint(noise_level, eval_start, eval_end) for noise_level in levels
+    ]
+    return hashlib.sha1(repr(fingerprints).encode()).hexdigest()[:16]
+
+
+def get_results(noise, eval_start, eval_end):
+    """Cleaned results for a single noise level."""
+    key = (noise, eval_start, eval_end)
+    fingerprint = dataset_fingerprint(*key)
+    df = data_cache.get(("dataset", *key), fingerprint)
+    if df is None:
+        df = load_results(*key)
+        data_cache.put(("dataset", *key), df, fingerprint)
+    return df
+
+
+def get_dataset(noise, eval_start, eval_end):
+    """Results for a noise level, or all noise levels combined for noise="all".
+
+    The returned frame may be shared with the cache and must not be modified.
+    """
+    if noise == "all":
+        frames = [
+            get_results(noise_level, eval_start, eval_end)
+            for noise_level in noise_levels
+        ]
+        with stage("concat"):
+            return concat_results(frames)
+    return get_results(noise, eval_start, eval_end)
+
+
+def load_index(noise, eval_start, eval_end):
+    path = fresh_store_path(noise, eval_start, eval_end)
+    if path is None or not os.path.exists(os.path.join(path, INDEX_FILE)):
+        return None
+    return BlockIndex.load(os.path.join(path, INDEX_FILE))
+
+
+def get_index(noise, eval_start, eval_end):
+    """Block index of the (sorted) results of a single noise level."""
+    key = (noise, eval_start, eval_end)
+    fingerprint = dataset_fingerprint(*key)
+    index = data_cache.get(("index", *key), fingerprint)
+    if index is None:
+        index = load_index(*key)
+        if index is None:
+            with stage("index"):
+                index = BlockIndex.from_frame(get_results(*key))
+        data_cache.put(("index", *key), index, fingerprint)
+    return index
+
+
+def select_results(
+    noise,
+    eval_start,
+    eval_end,
+    selected_activity,
+    pa_duration,
+    max_netiob,
+    min_glucose,
+    max_glucose,
+):
+    """Rows of get_dataset matching the filters, sliced using the block index.
+
+    The returned frame may be shared with the cache and must not be modified.
+    """
+    levels = noise_levels if noise == "all" else [noise]
+    filters = (selected_activity, pa_duration, max_netiob, min_glucose, max_glucose)
+    pieces = []
+    for noise_level in levels:
+        df = get_results(noise_level, eval_start, eval_end)
+        index = get_index(noise_level, eval_start, eval_end)
+        with stage("select"):
+            ranges = index.slices(*filters)
+            if len(ranges) == 1:
+                pieces.append(df.iloc[ranges[0][0] : ranges[0][1]])  # a view
+            elif ranges:
+                rows = np.concatenate([np.arange(*r) for r in ranges])
+                pieces.append(df.take(rows))
+    if not pieces:
+        return df.iloc[:0]
+    if len(pieces) == 1:
+        return pieces[0]
+    with stage("concat"):
+        return concat_results(pieces)
+
+
+def load_cube(noise, eval_start, eval_end):
+    path = fresh_store_path(noise, eval_start, eval_end)
+    if path is None or not os.path.exists(os.path.join(path, CUBE_FILE)):
+        return None
+    with stage("read_cube"):
+        return AggregateCube.load(os.path.join(path, CUBE_FILE))
+
+
+def get_results_cube(noise, eval_start, eval_end):
+    """Aggregate cube for a single noise level, if one was built by ingest."""
+    key = (noise, eval_start, eval_end)
+    fingerprint = dataset_fingerprint(*key)
+    cube = data_cache.get(("cube", *key), fingerprint)
+    if cube is None:
+        cube = load_cube(*key)
+        if cube is None:
+            return None
+        data_cache.put(("cube", *key), cube, fingerprint)
+    return cube
+
+
+def get_cube(noise, eval_start, eval_end):
+    """Aggregate cube for a noise level or for all noise levels combined.
+
+    Returns None if a cube is missing or the noise levels were simulated over
+    different grids; callers then aggregate the rows instead.
+    """
+    if noise != "all":
+        return get_results_cube(noise, eval_start, eval_end)
+    key = (noise, eval_start, eval_end)
+    fingerprint = tuple(
+        dataset_fingerprint(noise_level, eval_start, eval_end)
+        for noise_level in noise_levels
+    )
+    cube = data_cache.get(("cube", *key), fingerprint)
+    if cube is None:
+        cubes = [
+            get_results_cube(noise_level, eval_start, eval_end)
+            for noise_level in noise_levels
+        ]
+        if any(c is None for c in cubes) or not all(
+            cubes[0].same_grid(c) for c in cubes[1:]
+        ):
+            return None
+        cube = sum(cubes[1:], cubes[0])
+        data_cache.put(("cube", *key), cube, fingerprint)
+    return cube
+
+
+def load_sketch(noise, eval_start, eval_end):
+    path = fresh_store_path(noise, eval_start, eval_end)
+    if path is None or not os.path.exists(os.path.join(path, SKETCH_FILE)):
+        return None
+    return QuantileSketch.load(os.path.join(path, SKETCH_FILE))
+
+
+def get_sketch(noise, eval_start, eval_end):
+    """Quantile sketch of the results of a single noise level."""
+    key = (noise, eval_start, eval_end)
+    fingerprint = dataset_fingerprint(*key)
+    sketch = data_cache.get(("sketch", *key), fingerprint)
+    if sketch is None:
+        sketch = load_sketch(*key)
+        if sketch is None:
+            with stage("sketch"):
+                sketch = QuantileSketch.from_frame(get_results(*key))
+        data_cache.put(("sketch", *key), sketch, fingerprint)
+    return sketch
+
+
+def available_datasets():
+    """(noise, eval_start, eval_end) of every results file on disk."""
+    for key in itertools.product(noise_levels, eval_starts, eval_ends):
+        if os.path.exists(results_csv_path(*key)) or fresh_store_path(*key):
+            yield key
+
+
+def preload_datasets():
+    """Load every dataset, index, cube and sketch into the caches, pinned.
+
+    Pinned entries are never evicted. Run in the gunicorn master before it
+    forks (``PRELOAD_DATASETS=1``), the workers then share these arrays
+    copy-on-write instead of each loading their own copy.
+    """
+    before = memory_report()
+    n_datasets = 0
+    for key in available_datasets():
+        fingerprint = dataset_fingerprint(*key)
+        df = load_results(*key)
+        data_cache.put(("dataset", *key), df, fingerprint, pinned=True)
+        index = load_index(*key) or BlockIndex.from_frame(df)
+        data_cache.put(("index", *key), index, fingerprint, pinned=True)
+        cube = load_cube(*key)
+        if cube is not None:
+            data_cache.put(("cube", *key), cube, fingerprint, pinned=True)
+        sketch = load_sketch(*key) or QuantileSketch.from_frame(df)
+        data_cache.put(("sketch", *key), sketch, fingerprint, pinned=True)
+        n_datasets += 1
+    # objects that survive into the workers must not be touched by the garbage
+    # collector there, or their pages are copied
+    gc.freeze()
+    print(
+        f"preloaded {n_datasets} datasets "
+        f"({format_mb(data_cache.stats()['pinned_bytes'])}); "
+        f"before: {before}, after: {memory_report()}"
+    )
@@ -0,0 +1,201 @@
+"""Headless batch export of the aggregated results behind every filter combination.
+
+Computes the same per-intervention averages as the plot (pipeline.py) for the
+cross product of activities, durations, noise levels, evaluation windows,
+netIoB caps, glucose ranges and averaging modes, without Dash:
+
+    python export.py --output exports/ --format parquet --workers 8
+
+The work is split into one task per evaluation window, covering every noise
+level (and their combination) and activity of it, and spread over a process
+pool. The datasets of a window are only used by its task, so every results
+file is read by a single worker, once. Workers write their partitions
+themselves, so nothing but file names goes back to the parent. The output is a
+directory partitioned like
+``noise=all/eval_start=activity_start/eval_end=3hr_after/activity=walking/``.
+"""
+
+import argparse
+import contextlib
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from config import metrics_list, noise_levels, t1dexi_presets
+from datasets import available_datasets
+from pipeline import aggregate_results
+
+activities = list(t1dexi_presets)
+durations = [30, 60, "all"]
+noises = noise_levels + ["all"]
+netiob_caps = [0, 1, 2, 3]
+glucose_levels = [int(g) for g in np.arange(70, 260, 20)]
+averagings = ["Weighted", "Unweighted"]
+
+result_columns = ["label", "target_min", "preset"] + metrics_list
+
+
+def available_tasks(noises, windows):
+    """(noise, eval_start, eval_end) of the requested datasets found on disk."""
+    available = set(available_datasets())
+    for (eval_start, eval_end), noise in itertools.product(windows, noises):
+        levels = noise_levels if noise == "all" else [noise]
+        if all((level, eval_start, eval_end) in available for level in levels):
+            yield noise, eval_start, eval_end
+
+
+def filter_combinations(
+    durations=durations,
+    netiob_caps=netiob_caps,
+    glucose_levels=glucose_levels,
+    averagings=averagings,
+):
+    """(averaging, pa_duration, max_netiob, min_glucose, max_glucose) tuples."""
+    glucose_ranges = [
+        (lo, hi) for lo, hi in itertools.product(glucose_levels, repeat=2) if lo <= hi
+    ]
+    for averaging, duration, netiob, (lo, hi) in itertools.product(
+        averagings, durations, netiob_caps, glucose_ranges
+    ):
+        yield averaging, duration, netiob, lo, hi
+
+
+def partition_path(output, noise, eval_start, eval_end, activity):
+    return os.path.join(
+        output,
+        f"noise={noise}",
+        f"eval_start={eval_start}",
+        f"eval_end={eval_end}",
+        f"activity={activity}",
+    )
+
+
+def export_partition(output, fmt, noise, eval_start, eval_end, activity, filters):
+    """Aggregate every filter combination of one dataset and activity."""
+    tables = []
+    for averaging, duration, netiob, lo, hi in filters:
+        df_avg = aggregate_results(
+            activity, duration, noise, netiob, averaging, lo, hi, eval_start, eval_end
+        )
+        if len(df_avg) == 0:
+            continue
+        df_avg = df_avg[result_columns]
+        df_avg.insert(0, "averaging", averaging)
+        df_avg.insert(1, "pa_duration", str(duration))
+        df_avg.insert(2, "max_netiob", netiob)
+        df_avg.insert(3, "min_glucose", lo)
+        df_avg.insert(4, "max_glucose", hi)
+        tables.append(df_avg)
+    if not tables:
+        return None, 0
+    table = pd.concat(tables, ignore_index=True)
+    path = partition_path(output, noise, eval_start, eval_end, activity)
+    os.makedirs(path, exist_ok=True)
+    if fmt == "parquet":
+        fname = os.path.join(path, "part-0.parquet")
+        table.to_parquet(fname, index=False)
+    else:
+        fname = os.path.join(path, "part-0.csv")
+        table.to_csv(fname, index=False)
+    return fname, len(table)
+
+
+def export_task(task):
+    """Export the partitions of every noise level and activity of one window."""
+    output, fmt, (eval_start, eval_end), noises, activities, filters = task
+    return [
+        export_partition(output, fmt, noise, eval_start, eval_end, activity, filters)
+        for noise, activity in itertools.product(noises, activities)
+    ]
+
+
+def export_aggregates(
+    output,
+    fmt="csv",
+    workers=None,
+    activities=activities,
+    noises=noises,
+    windows=None,
+    **filters,
+):
+    """Write the aggregates of every combination below output; returns the files.
+
+    filters are passed on to filter_combinations.
+    """
+    if windows is None:
+        windows = sorted({(s, e) for _, s, e in available_datasets()})
+    combinations = list(filter_combinations(**filters))
+    # noise="all" reads the files of the single noise levels: all of them go
+    # in one task, so that no other worker reads the window's files
+    window_noises = {}
+    for noise, eval_start, eval_end in available_tasks(noises, windows):
+        window_noises.setdefault((eval_start, eval_end), []).append(noise)
+    tasks = [
+        (output, fmt, window, window_noises[window], activities, combinations)
+        for window in window_noises
+    ]
+    n_partitions = sum(len(ns) for ns in window_noises.values()) * len(activities)
+    files = []
+    n_rows = 0
+    start = time.perf_counter()
+    workers = workers or os.cpu_count()
+    pool = ProcessPoolExecutor(workers) if workers > 1 else contextlib.nullcontext()
+    with pool:
+        results = (
+            pool.map(export_task, tasks) if workers > 1 else map(export_task, tasks)
+        )
+        for i, partitions in enumerate(results, 1):
+            for fname, rows in partitions:
+                if fname is not None:
+                    files.append(fname)
+                    n_rows += rows
+            eval_start, eval_end = tasks[i - 1][2]
+            print(
+                f"[{i}/{len(tasks)}] {eval_start} to {eval_end}: {len(partitions)} files"
+            )
+    print(
+        f"exported {n_partitions * len(combinations)} combinations "
+        f"({n_rows} rows, {len(files)} files) in {time.perf_counter() - start:.1f} s "
+        f"with {workers} workers"
+    )
+    return files
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="exports")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--workers", type=int, help="default: number of CPUs")
+    parser.add_argument("--activities", nargs="+", default=activities)
+    parser.add_argument("--noise", nargs="+", default=noises)
+    parser.add_argument("--durations", nargs="+", default=[str(d) for d in durations])
+    parser.add_argument("--netiob", nargs="+", type=int, default=netiob_caps)
+    parser.add_argument("--glucose", nargs="+", type=int, default=glucose_levels)
+    parser.add_argument(
+        "--averaging", nargs="+", choices=averagings, default=averagings
+    )
+    args = parser.parse_args(argv)
+    if args.format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error("--format parquet needs pyarrow (pip install pyarrow)")
+    export_aggregates(
+        args.output,
+        fmt=args.format,
+        workers=args.workers,
+        activities=args.activities,
+        noises=args.noise,
+        durations=[d if d == "all" else int(d) for d in args.durations],
+        netiob_caps=args.netiob,
+        glucose_levels=args.glucose,
+        averagings=args.averaging,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Figure cache shared by all app processes on the instance.
+
+gunicorn workers each build the same figures for the same dropdown values.
+Figures are stored as JSON in a SQLite database on local disk, so a figure
+built by one worker is a hit for every other worker. Entries expire after a
+TTL and the least recently used ones are evicted beyond a maximum count.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+FIGURE_CACHE_DIR = os.environ.get(
+    "FIGURE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "t1d-pa-figure-cache")
+)
+FIGURE_CACHE_ENTRIES = int(os.environ.get("FIGURE_CACHE_ENTRIES", 512))
+FIGURE_CACHE_TTL = float(os.environ.get("FIGURE_CACHE_TTL", 24 * 3600))  # seconds
+
+# a process forked while one of its threads is inside SQLite inherits SQLite's
+# internal mutexes locked and hangs on its first SQLite call: every use of
+# SQLite in the app holds this lock, and background jobs are forked under it
+sqlite_lock = threading.RLock()
+
+
+def _reset_lock():
+    global sqlite_lock
+    sqlite_lock = threading.RLock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_lock)
+
+
+def locked(method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with sqlite_lock:
+            return method(*args, **kwargs)
+
+    return wrapper
+
+
+def make_key(inputs, version):
+    """Cache key of a figure from the callback inputs and the dataset version."""
+    normalized = json.dumps(
+        [list(inputs), version], default=lambda o: o.item()
+    )  # numpy scalars from the dropdown options
+    return hashlib.sha1(normalized.encode()).hexdigest()
+
+
+class FigureCache:
+    def __init__(
+        self,
+        path=os.path.join(FIGURE_CACHE_DIR, "figures.sqlite"),
+        max_entries=FIGURE_CACHE_ENTRIES,
+        ttl=FIGURE_CACHE_TTL,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+
+    def _connect(self):
+        # sqlite connections can't be shared between threads or forked workers
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS figures (key TEXT PRIMARY KEY, "
+                "value TEXT, created REAL, accessed REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, conn, name):
+        conn.execute(
+            "INSERT INTO stats VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    @locked
+    def get(self, key):
+        """Figure JSON for key, or None on a miss."""
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute(
+            "SELECT value, created FROM figures WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None and now - row[1] > self.ttl:
+            conn.execute("DELETE FROM figures WHERE key = ?", (key,))
+            row = None
+        if row is None:
+            self._count(conn, "misses")
+            return None
+        conn.execute("UPDATE figures SET accessed = ? WHERE key = ?", (now, key))
+        self._count(conn, "hits")
+        return row[0]
+
+    @locked
+    def put(self, key, value):
+        conn = self._connect()
+        now = time.time()
+        conn.execute(
+            "INSERT OR REPLACE INTO figures VALUES (?, ?, ?, ?)", (key, value, now, now)
+        )
+        conn.execute(
+            "DELETE FROM figures WHERE key IN (SELECT key FROM figures "
+            "ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        return value
+
+    @locked
+    def clear(self):
+        conn = self._connect()
+        conn.execute("DELETE FROM figures")
+        conn.execute("DELETE FROM stats")
+
+    @locked
+    def stats(self):
+        conn = self._connect()
+        stats = dict(conn.execute("SELECT name, value FROM stats").fetchall())
+        return {
+            "entries": conn.execute("SELECT COUNT(*) FROM figures").fetchone()[0],
+            "hits": stats.get("hits", 0),
+            "misses": stats.get("misses", 0),
+        }
+
+
+figure_cache = FigureCache()
@@ -0,0 +1,456 @@
+"""Render stage of the plot: the scatter figure of an aggregate."""
+
+import functools
+import json
+
+import numpy as np
+import pandas as pd
+from plotly.colors import sample_colorscale
+
+try:
+    import orjson
+except ImportError:  # optional, only makes serialization faster
+    orjson = None
+
+from config import noise_levels, t1dexi_presets
+
+target_mins = list(np.arange(100, 180, 20))
+target_mins.append(150)
+target_mins.sort()
+target_labels = [f"{v}-{v+20}" for v in target_mins]
+sample_points = [
+    0.25,
+    0.4,
+    0.6,
+    0.8,
+    1.0,
+]  # sample points for the target-based color map
+colors = sample_colorscale("Blues", sample_points)
+color_map = dict(zip(target_labels, colors))
+
+
+# plot aesthetics, shared with the clientside renderer
+layout_style = dict(
+    paper_bgcolor="#0F203A",
+    font=dict(family="Basis Grotesque Pro", color="white"),
+    title_font=dict(size=20, color="white"),
+    legend=dict(
+        title=dict(
+            text="Key [Target]",  # Your custom legend title
+            font=dict(family="Basis Grotesque Pro", size=16, color="white"),
+        ),
+        bordercolor="white",
+        borderwidth=1,
+        font=dict(family="Basis Grotesque Pro", color="white", size=16),
+        x=1.05,
+        y=0.5,
+        xanchor="left",
+        yanchor="middle",
+        # itemclick="toggleothers",
+    ),
+    margin=dict(l=50, r=300, t=50, b=50),
+    legend_tracegroupgap=4,
+)
+
+
+# traces of views with more points than this are drawn with WebGL; the
+# averaged views have about 100 points, so only a per-simulation view would
+# reach it
+WEBGL_MIN_POINTS = 1000
+
+# gap between the groups of boxes of the distribution view (plotly's default)
+BOX_GAP = 0.3
+
+
+@functools.lru_cache(maxsize=None)
+def layout_template():
+    """Layout shared by every figure, built and validated on first use.
+
+    build_figure only sets the title and axes on a shallow copy, so this is
+    never modified. plotly.graph_objects is imported here, off the startup
+    path.
+    """
+    import plotly.graph_objects as go
+    import plotly.io as pio
+
+    template = go.Layout(**layout_style).to_plotly_json()
+    template["legend"]["itemsizing"] = "constant"
+    template["template"] = pio.templates[pio.templates.default].to_plotly_json()
+    return template
+
+
+# comparison view: facets per row and horizontal/vertical gap between them
+facet_columns = 4
+facet_spacing = (0.04, 0.12)
+facet_names = {
+    "activity": "Activity",
+    "pa_duration": "Activity Duration",
+    "noise": "Noise",
+}
+noise_names = {
+    "nonoise": "No Noise",
+    "samplednoise": "Uniformly Sampled Noise",
+    "fullnoise": "25% Noise",
+}
+
+highlight_markers = {
+    "baseline": dict(symbol="diamond", color="#A1BB97", size=14, line=dict(width=0)),
+    "raised_target": dict(
+        symbol="diamond", color="#E5CFA4", size=14, line=dict(width=0)
+    ),
+    "preset_only": dict(symbol="star", color="#D4938B", size=18, line=dict(width=0)),
+    "preset_and_raised_target": dict(
+        symbol="star", color="pink", size=18, line=dict(width=0)
+    ),
+}
+
+
+def highlight_trace(df_avg, mask, name, marker, x_metric, y_metric, trace_type):
+    """Trace of a highlighted intervention, or None if it is not in df_avg."""
+    x = df_avg[x_metric].to_numpy()[mask]
+    y = df_avg[y_metric].to_numpy()[mask]
+    if len(x) == 0:
+        return None
+    return {
+        "type": trace_type,
+        "mode": "markers",
+        "name": name,
+        "showlegend": True,
+        "x": x,
+        "y": y,
+        "customdata": [[label] for label in df_avg["label"].to_numpy()[mask]],
+        "marker": marker,
+        "hovertemplate": (
+            f"{x_metric}: {x[0]:.2f}<br>"
+            f"{y_metric}: {y[0]:.2f}<br>"
+            "%{customdata[0]}<extra></extra>"
+        ),
+    }
+
+
+def error_bars(df_avg, metric, mask):
+    """Error bars of a trace from the "<metric> lo"/"<metric> hi" columns, if any."""
+    if f"{metric} lo" not in df_avg:
+        return None
+    value = df_avg[metric].to_numpy()[mask]
+    return {
+        "type": "data",
+        "symmetric": False,
+        "array": df_avg[f"{metric} hi"].to_numpy()[mask] - value,
+        "arrayminus": value - df_avg[f"{metric} lo"].to_numpy()[mask],
+        "thickness": 1,
+        "width": 0,
+    }
+
+
+def trace_options(df_avg, webgl=None):
+    """Trace type and marker sizeref (as px.scatter with size_max=18) of a view.
+
+    webgl draws Scattergl traces; by default they are used for more than
+    WEBGL_MIN_POINTS points, e.g. un-averaged per-simulation results.
+    """
+    if webgl is None:
+        webgl = len(df_avg) > WEBGL_MIN_POINTS
+    size = df_avg["size"].to_numpy()
+    size_max = 18
+    sizeref = float(size.max()) / size_max**2 if len(size) else 1.0
+    return ("scattergl" if webgl else "scatter"), sizeref
+
+
+def scatter_traces(df_avg, t1dexi_preset, x_metric, y_metric, trace_type, sizeref):
+    """One trace per target and the highlighted intervention traces.
+
+    The target traces get error bars when df_avg holds confidence intervals
+    of the metrics (pipeline.bootstrap_results).
+    """
+    targets = df_avg["Target"].to_numpy()
+    presets = df_avg["preset"].to_numpy()
+    labels = df_avg["label"].to_numpy()
+    x = df_avg[x_metric].to_numpy()
+    y = df_avg[y_metric].to_numpy()
+    size = df_avg["size"].to_numpy()
+
+    data = []
+    for target in pd.unique(targets):
+        mask = targets == target
+        data.append(
+            {
+                "type": trace_type,
+                "mode": "markers",
+                "name": target,
+                "legendgroup": target,
+                "showlegend": True,
+                "orientation": "v",
+                "x": x[mask],
+                "y": y[mask],
+                "customdata": [[label] for label in labels[mask]],
+                "marker": {
+                    "color": color_map.get(target),
+                    "opacity": 0.75,
+                    "size": size[mask],
+                    "sizemode": "area",
+                    "sizeref": sizeref,
+                    "symbol": "circle",
+                },
+                "hovertemplate": (
+                    f"{x_metric}=%{{x}}<br>{y_metric}=%{{y}}<br>"
+                    "label=%{customdata[0]}<extra></extra>"
+                ),
+                "xaxis": "x",
+                "yaxis": "y",
+            }
+        )
+        for axis, metric in (("error_x", x_metric), ("error_y", y_metric)):
+            bars = error_bars(df_avg, metric, mask)
+            if bars is not None:
+                data[-1][axis] = bars
+
+    # highlight the baseline (default target and 100% preset), the raised
+    # target, the T1DEXI preset only and the preset + raised target points
+    t1dexi_pct = int(t1dexi_preset * 100)
+    highlights = [
+        (
+            (targets == "100-120") & (presets == 1.0),
+            "No Action<br><sub>Default target 100-120, Preset 100%</sub>",
+            highlight_markers["baseline"],
+        ),
+        (
+            (targets == "150-170") & (presets == 1.0),
+            "Raised Target<br><sub>Target 150-170, Preset 100%</sub>",
+            highlight_markers["raised_target"],
+        ),
+        (
+            (targets == "100-120") & (presets == t1dexi_preset),
+            "Preset Only<br><sub>Default target 100-120, "
+            f"T1DEXI Preset {t1dexi_pct}%</sub>",
+            highlight_markers["preset_only"],
+        ),
+        (
+            (targets == "150-170") & (presets == t1dexi_preset),
+            "Preset + Raised Target<br><sub>Target 150-170, "
+            f"Preset {t1dexi_pct}%</sub>",
+            highlight_markers["preset_and_raised_target"],
+        ),
+    ]
+    for mask, name, marker in highlights:
+        trace = highlight_trace(
+            df_avg, mask, name, marker, x_metric, y_metric, trace_type
+        )
+        if trace is not None:
+            data.append(trace)
+    return data
+
+
+def build_figure(df_avg, selected_activity, x_metric, y_metric, webgl=None):
+    """Plotly figure (as a dict) of the aggregate, one trace per target.
+
+    Equivalent to px.scatter plus the highlight traces, but built directly
+    from the arrays against layout_template().
+    """
+    trace_type, sizeref = trace_options(df_avg, webgl)
+    data = scatter_traces(
+        df_avg,
+        t1dexi_presets[selected_activity],
+        x_metric,
+        y_metric,
+        trace_type,
+        sizeref,
+    )
+    template = layout_template()
+    layout = dict(
+        template,
+        title=dict(
+            template["title"],
+            text=f"{y_metric} vs {x_metric} for {selected_activity}",
+        ),
+        xaxis={"anchor": "y", "domain": [0.0, 1.0], "title": {"text": x_metric}},
+        yaxis={"anchor": "x", "domain": [0.0, 1.0], "title": {"text": y_metric}},
+    )
+    return {"data": data, "layout": layout}
+
+
+def facet_title(facet, value):
+    if facet == "activity":
+        return value.title()
+    if facet == "pa_duration":
+        return f"{value} min"
+    return noise_names.get(value, value)
+
+
+def build_facet_figure(
+    df_avg, facet, selected_activity, x_metric, y_metric, webgl=None
+):
+    """Side-by-side figures of a faceted aggregate, one per facet value.
+
+    The subplots share their axis ranges and legend; the T1DEXI preset
+    highlights use the preset of each facet's activity.
+    """
+    trace_type, sizeref = trace_options(df_avg, webgl)
+    values = pd.unique(df_avg["facet"].to_numpy())
+    if facet == "noise":
+        values = sorted(values, key=noise_levels.index)
+    n_cols = min(len(values), facet_columns) or 1
+    n_rows = -(-len(values) // n_cols)
+    width = (1 - (n_cols - 1) * facet_spacing[0]) / n_cols
+    height = (1 - (n_rows - 1) * facet_spacing[1]) / n_rows
+
+    data = []
+    legend_names = set()
+    facet_values = df_avg["facet"].to_numpy()
+    template = layout_template()
+    layout = dict(
+        template,
+        title=dict(
+            template["title"],
+            text=f"{y_metric} vs {x_metric} by {facet_names[facet]}",
+        ),
+        annotations=[],
+    )
+    for k, value in enumerate(values):
+        row, col = divmod(k, n_cols)
+        suffix = str(k + 1) if k else ""
+        activity = value if facet == "activity" else selected_activity
+        traces = scatter_traces(
+            df_avg[facet_values == value],
+            t1dexi_presets[activity],
+            x_metric,
+            y_metric,
+            trace_type,
+            sizeref,
+        )
+        for trace in traces:
+            # one legend entry per target or highlight, toggling every facet
+            trace["legendgroup"] = trace["name"]
+            trace["showlegend"] = trace["name"] not in legend_names
+            trace["xaxis"] = "x" + suffix
+            trace["yaxis"] = "y" + suffix
+            legend_names.add(trace["name"])
+        data.extend(traces)
+
+        x0 = col * (width + facet_spacing[0])
+        y1 = 1 - row * (height + facet_spacing[1])
+        bottom = k + n_cols >= len(values)
+        layout["xaxis" + suffix] = {
+            "anchor": "y" + suffix,
+            "domain": [x0, x0 + width],
+            "title": {"text": x_metric if bottom else ""},
+        }
+        layout["yaxis" + suffix] = {
+            "anchor": "x" + suffix,
+            "domain": [y1 - height, y1],
+            "title": {"text": y_metric if col == 0 else ""},
+        }
+        if k:
+            layout["xaxis" + suffix]["matches"] = "x"
+            layout["yaxis" + suffix]["matches"] = "y"
+        layout["annotations"].append(
+            {
+                "text": facet_title(facet, value),
+                "x": x0 + width / 2,
+                "y": y1,
+                "xref": "paper",
+                "yref": "paper",
+                "xanchor": "center",
+                "yanchor": "bottom",
+                "showarrow": False,
+                "font": {"size": 16},
+            }
+        )
+    return {"data": data, "layout": layout}
+
+
+def build_distribution_figure(df_q, selected_activity, y_metric):
+    """Box plot (as a dict) of the per-intervention quantiles of y_metric.
+
+    df_q is a pipeline.distribution_results frame. One box per preset and
+    target, from the quartiles and median, with whiskers at p1 and p99 and
+    ticks at p10 and p90. Violins would need the samples themselves, so
+    boxes are drawn.
+    """
+    targets = df_q["Target"].to_numpy()
+    presets = [f"{int(round(p * 100))}%" for p in df_q["preset"].to_numpy()]
+    presets = np.array(presets, dtype=object)
+    data = []
+    for target in pd.unique(targets):
+        mask = targets == target
+        data.append(
+            {
+                "type": "box",
+                "name": target,
+                "legendgroup": target,
+                "x": presets[mask].tolist(),
+                "q1": df_q["p25"].to_numpy()[mask],
+                "median": df_q["median"].to_numpy()[mask],
+                "q3": df_q["p75"].to_numpy()[mask],
+                "lowerfence": df_q["p1"].to_numpy()[mask],
+                "upperfence": df_q["p99"].to_numpy()[mask],
+                "marker": {"color": color_map.get(target)},
+                "line": {"width": 1},
+                "offsetgroup": target,
+            }
+        )
+        # box hover labels are fixed to the box statistics, so p10 and p90
+        # are markers of their own, placed on the box by offsetgroup
+        x = presets[mask].tolist()
+        data.append(
+            {
+                "type": "scatter",
+                "mode": "markers",
+                "name": target,
+                "legendgroup": target,
+                "showlegend": False,
+                "x": x + x,
+                "y": np.concatenate(
+                    [df_q["p10"].to_numpy()[mask], df_q["p90"].to_numpy()[mask]]
+                ),
+                "text": ["p10"] * len(x) + ["p90"] * len(x),
+                "hovertemplate": "%{text}: %{y}",
+                "marker": {
+                    "color": color_map.get(target),
+                    "symbol": "line-ew-open",
+                    "size": 10,
+                    "line": {"width": 2},
+                },
+                "offsetgroup": target,
+            }
+        )
+    template = layout_template()
+    layout = dict(
+        template,
+        title=dict(
+            template["title"],
+            text=f"Distribution of {y_metric} for {selected_activity}",
+        ),
+        boxmode="group",
+        # the markers of a target are only centred on its boxes with equal gaps
+        scattermode="group",
+        scattergap=BOX_GAP,
+        boxgap=BOX_GAP,
+        xaxis={"title": {"text": "Preset"}, "type": "category"},
+        yaxis={"title": {"text": y_metric}},
+    )
+    return {"data": data, "layout": layout}
+
+
+def figure_json(figure):
+    """Serialize a figure dict, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(figure, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    from plotly.utils import PlotlyJSONEncoder
+
+    return json.dumps(figure, cls=PlotlyJSONEncoder)
+
+
+def figure_loads(value):
+    return orjson.loads(value) if orjson is not None else json.loads(value)
+
+
+def clientside_style():
+    """Static styling the clientside renderer (assets/clientside.js) needs."""
+    template = layout_template()
+    return {
+        "template": template["template"],
+        "layout": {k: v for k, v in template.items() if k != "template"},
+        "color_map": color_map,
+        "t1dexi_presets": t1dexi_presets,
+    }
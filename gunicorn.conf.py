@@ -0,0 +1,27 @@
+# gunicorn settings, read automatically by `gunicorn my_app:server`
+import os
+import sys
+
+from memory import memory_report
+
+# With PRELOAD_DATASETS=1 (or --preload) the app, and every dataset, is loaded
+# once in the master and shared copy-on-write by the forked workers.
+preload_app = os.environ.get("PRELOAD_DATASETS", "0") == "1" or "--preload" in sys.argv
+if preload_app:
+    os.environ["PRELOAD_DATASETS"] = "1"
+
+# the memory budget (MEMORY_BUDGET_MB) covers the master and every process
+# it forks, see memory.app_memory_bytes
+os.environ["MEMORY_ROOT_PID"] = str(os.getpid())
+
+
+def when_ready(server):
+    server.log.info(f"master ready: {memory_report()}")
+
+
+def post_fork(server, worker):
+    server.log.info(f"worker {worker.pid} forked: {memory_report()}")
+
+
+def post_worker_init(worker):
+    worker.log.info(f"worker {worker.pid} initialized: {memory_report()}")
@@ -0,0 +1,247 @@
+"""Named stage timers for the plot pipeline.
+
+Stages are timed with ``with stage("read"): ...``. The timings of a Dash
+callback request are returned in its ``Server-Timing`` header, and every
+timing is added to a Prometheus histogram served on ``/metrics`` (per worker
+process). Set APP_INSTRUMENTATION=0 to turn this off; ``stage`` then returns a
+shared no-op context manager. The phases of the app's startup are timed with
+``startup_phase`` and exported on ``/metrics`` too.
+
+The memory of each callback request is reported alongside: the RSS of the
+process when it finished and how far the request raised the peak RSS, plus,
+with APP_TRACEMALLOC=1, the peak of the Python (numpy and pandas included)
+allocations made while it ran. These peaks are per process, so with several
+threads per worker they include the requests running at the same time.
+"""
+
+import contextlib
+import os
+import threading
+import time
+import tracemalloc
+
+from flask import Response, request
+
+from memory import format_mb, peak_rss_bytes, reset_peak_rss, rss_bytes
+
+INSTRUMENTATION = os.environ.get("APP_INSTRUMENTATION", "1") != "0"
+# trace allocations for the memory peaks of callbacks; slows allocations down
+TRACEMALLOC = os.environ.get("APP_TRACEMALLOC", "0") == "1"
+
+METRIC_PREFIX = "t1d_pa"
+buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+memory_buckets = tuple(mb * 2**20 for mb in (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000))
+
+_null_stage = contextlib.nullcontext()
+_local = threading.local()  # timings of the request handled by this thread
+_lock = threading.Lock()
+_histograms = {}
+_memory_histograms = {}  # (callback, measure) -> Histogram of bytes
+startup_phases = {}  # phase -> seconds, see startup_phase
+
+
+def _reset_lock():
+    global _lock
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_lock)
+
+
+class Histogram:
+    def __init__(self, buckets=buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        lines = []
+        cumulative = 0
+        for upper, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{upper}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def stage(name):
+    """Context manager timing the named pipeline stage."""
+    if not INSTRUMENTATION:
+        return _null_stage
+    return _Stage(name)
+
+
+def record(name, seconds):
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = Histogram()
+        histogram.observe(seconds)
+    timings = getattr(_local, "timings", None)
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+def start_memory():
+    """Memory at the start of a request, resetting the peaks measured."""
+    traced = None
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+        traced = tracemalloc.get_traced_memory()[0]
+    return rss_bytes(), reset_peak_rss(), traced
+
+
+def memory_use(start):
+    """{measure: bytes} of the memory used by a request since start_memory."""
+    rss, peak_reset, traced = start
+    use = {"rss": rss_bytes()}
+    peak = peak_rss_bytes()
+    if peak_reset and rss is not None and peak is not None:
+        use["rss_peak_growth"] = max(peak - rss, 0)
+    if traced is not None:
+        use["alloc_peak"] = max(tracemalloc.get_traced_memory()[1] - traced, 0)
+    return use
+
+
+def record_memory(callback, use):
+    with _lock:
+        for measure, nbytes in use.items():
+            if measure == "rss" or nbytes is None:
+                continue  # a level, not something the request did
+            histogram = _memory_histograms.get((callback, measure))
+            if histogram is None:
+                histogram = _memory_histograms[(callback, measure)] = Histogram(
+                    memory_buckets
+                )
+            histogram.observe(nbytes)
+
+
+def memory_timing(use):
+    return ", ".join(
+        f'{measure};desc="{format_mb(nbytes)}"' for measure, nbytes in use.items()
+    )
+
+
+def callback_name():
+    """The outputs of the Dash callback of the current request."""
+    body = request.get_json(silent=True) or {}
+    return str(body.get("output", "")).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def record_startup(phase, seconds):
+    startup_phases[phase] = seconds
+    print(f"startup: {phase} took {seconds * 1000:.0f} ms")
+
+
+@contextlib.contextmanager
+def startup_phase(phase):
+    """Context manager timing a phase of the app's startup.
+
+    Startup phases are printed and exported on /metrics; unlike stages they
+    are timed even with APP_INSTRUMENTATION=0.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_startup(phase, time.perf_counter() - start)
+
+
+def server_timing(timings):
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings)
+
+
+def render_metrics(gauges=None):
+    """Stage histograms and gauges in the Prometheus text format."""
+    name = f"{METRIC_PREFIX}_stage_duration_seconds"
+    lines = [
+        f"# HELP {name} Duration of the plot pipeline stages.",
+        f"# TYPE {name} histogram",
+    ]
+    with _lock:
+        for stage_name, histogram in sorted(_histograms.items()):
+            lines.extend(histogram.lines(name, f'stage="{stage_name}"'))
+        memory_histograms = sorted(_memory_histograms.items())
+    if memory_histograms:
+        name = f"{METRIC_PREFIX}_callback_memory_bytes"
+        lines.append(f"# HELP {name} Memory used by the callback requests.")
+        lines.append(f"# TYPE {name} histogram")
+        for (callback, measure), histogram in memory_histograms:
+            labels = f'callback="{callback}",measure="{measure}"'
+            lines.extend(histogram.lines(name, labels))
+    if startup_phases:
+        name = f"{METRIC_PREFIX}_startup_seconds"
+        lines.append(f"# HELP {name} Duration of the app's startup phases.")
+        lines.append(f"# TYPE {name} gauge")
+        for phase, seconds in startup_phases.items():
+            lines.append(f'{name}{{phase="{phase}"}} {seconds}')
+    for gauge, value in (gauges() if gauges else {}).items():
+        lines.append(f"# TYPE {METRIC_PREFIX}_{gauge} gauge")
+        lines.append(f"{METRIC_PREFIX}_{gauge} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def init_app(server, gauges=None):
+    """Add Server-Timing headers and the /metrics route to the Flask server.
+
+    gauges is an optional callable returning {metric name: value} to export
+    next to the stage histograms.
+    """
+    if not INSTRUMENTATION:
+        return
+    if TRACEMALLOC:
+        tracemalloc.start()
+
+    @server.before_request
+    def start_timings():
+        _local.timings = []
+        _local.start = time.perf_counter()
+        if request.path.endswith("_dash-update-component"):
+            _local.memory = start_memory()
+
+    @server.after_request
+    def add_server_timing(response):
+        timings = getattr(_local, "timings", None)
+        _local.timings = None
+        if timings is not None and request.path.endswith("_dash-update-component"):
+            total = time.perf_counter() - _local.start
+            record("request", total)
+            use = memory_use(_local.memory)
+            record_memory(callback_name(), use)
+            response.headers["Server-Timing"] = (
+                server_timing(timings + [("request", total)])
+                + ", "
+                + memory_timing(use)
+            )
+        return response
+
+    @server.route("/metrics")
+    def metrics():
+        return Response(render_metrics(gauges), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,89 @@
+"""Process memory usage, read from /proc where available."""
+
+import glob
+import os
+import resource
+
+
+def _proc_field(path, field):
+    """Value in bytes of a 'Field:   123 kB' line of a /proc file."""
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def rss_bytes(pid="self"):
+    """Resident set size of a process (pages shared with other processes included)."""
+    rss = _proc_field(f"/proc/{pid}/status", "VmRSS")
+    if rss is None and pid in ("self", os.getpid()):
+        # no /proc (e.g. macOS): fall back to the peak RSS of this process
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return rss
+
+
+def peak_rss_bytes(pid="self"):
+    """Highest RSS of a process since it started, or since reset_peak_rss."""
+    return _proc_field(f"/proc/{pid}/status", "VmHWM")
+
+
+def reset_peak_rss():
+    """Reset the peak RSS of this process to its RSS; False where unsupported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def pss_bytes(pid="self"):
+    """Proportional set size: shared pages divided among the processes sharing them."""
+    return _proc_field(f"/proc/{pid}/smaps_rollup", "Pss")
+
+
+def format_mb(nbytes):
+    return "n/a" if nbytes is None else f"{nbytes / 2**20:.1f} MB"
+
+
+def memory_report(pid="self"):
+    return f"RSS {format_mb(rss_bytes(pid))}, PSS {format_mb(pss_bytes(pid))}"
+
+
+def child_pids(pid):
+    """Pids of the direct children of a process ([] without /proc)."""
+    children = []
+    for task in glob.glob(f"/proc/{pid}/task/*/children"):
+        try:
+            with open(task) as f:
+                children.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return children
+
+
+def tree_pids(pid):
+    """pid and the pids of all its descendants."""
+    pids = [pid]
+    for parent in pids:
+        pids.extend(child_pids(parent))
+    return pids
+
+
+def app_memory_bytes():
+    """Memory used by all the processes of the app.
+
+    These are the gunicorn master (whose pid gunicorn.conf.py puts in
+    MEMORY_ROOT_PID), its workers and their background jobs, or this process
+    and its children outside of gunicorn. Each process counts its PSS, so
+    pages shared copy-on-write are counted once. Without /proc, this is the
+    RSS of this process.
+    """
+    if not os.path.exists("/proc/self/smaps_rollup"):
+        return rss_bytes()
+    root = int(os.environ.get("MEMORY_ROOT_PID", os.getpid()))
+    return sum(pss_bytes(pid) or 0 for pid in tree_pids(root))
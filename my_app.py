@@ -1,81 +1,113 @@
+import os
+import tempfile
+import threading
+import time
+
+started = time.perf_counter()  # startup phases are reported from here
+
 import dash
 from dash import dcc, html
-from dash.dependencies import Input, Output
-import pandas as pd
-import plotly.express as px
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
+import flask
 import numpy as np
-from scipy.stats import lognorm
-from plotly.colors import sample_colorscale
-import plotly.graph_objects as go
-
-col_names = [
-    "sim_condition",
-    "starting_glucose",
-    "netIoB",
-    "pa_duration",
-    "activity",
-    "preset",
-    "target_min",
-    "target_max",
-    "vp_index",
-    "noise_condition",
-    "del_g",
-    "LBGI",
-    "HBGI",
-    "BGRI",
-    "%TBR (<54 mg/dl)",
-    "%TBR (<54-<70 mg/dl)",
-    "%TBR (<70 mg/dl)",
-    "%TIR (70-180 mg/dl)",
-    "%TAR (>180 mg/dl)",
-    "%TAR (>180-<=250 mg/dl)",
-    "%TAR (>=250 mg/dl)",
-    "basal",
-    "bolus",
-    "Magni Risk",
-]  # column names of the dataframes
-
-metrics_list = [
-    "%TIR (70-180 mg/dl)",
-    "%TBR (<54 mg/dl)",
-    "%TBR (<70 mg/dl)",
-    "%TAR (>180 mg/dl)",
-    "LBGI",
-    "HBGI",
-    "BGRI",
-    "Magni Risk",
-]
+import pandas as pd
+
+try:
+    import diskcache
+except ImportError:  # optional, without it every callback runs in the request
+    diskcache = None
+
+import cache
+import pipeline
+from cache import MEMORY_BUDGET_MB, memory_pressure
+from config import metrics_list
+from datasets import (
+    PRELOAD_DATASETS,
+    data_cache,
+    dataset_version,
+    preload_datasets,
+)
+from figure_cache import figure_cache, make_key
+from figures import (
+    build_distribution_figure,
+    build_facet_figure,
+    build_figure,
+    clientside_style,
+    figure_json,
+    figure_loads,
+)
+from instrumentation import init_app, record_startup, stage, startup_phase
+from memory import app_memory_bytes, rss_bytes
+from pipeline import aggregate_cache, get_aggregate, get_distribution, get_intervals
+from responses import asset_url, set_etag
+from responses import init_app as init_responses
+from weighting import DEFAULT_WEIGHTING, distributions
+
+record_startup("imports", time.perf_counter() - started)
+app_started = time.perf_counter()
+
+# build figures in the browser from the aggregated table instead of on the server
+CLIENTSIDE_RENDERING = os.environ.get("CLIENTSIDE_RENDERING", "0") == "1"
+
+# compute aggregates in background processes, so that slow combinations do
+# not hold up the server's request threads; needs diskcache. Off by default:
+# every job is a fork that exits when done, so what it loads and computes
+# never reaches the server's caches and each job starts cold
+BACKGROUND_CALLBACKS = (
+    os.environ.get("BACKGROUND_CALLBACKS", "0") == "1" and diskcache is not None
+)
+BACKGROUND_CACHE_DIR = os.environ.get(
+    "BACKGROUND_CACHE_DIR", os.path.join(tempfile.gettempdir(), "t1d-pa-background")
+)
+BACKGROUND_RESULT_TTL = 60  # seconds a result is kept after being read
 
-t1dexi_presets = {
-    "walking": 0.2,
-    "biking": 0.2,
-    "jogging": 0.2,
-    "strength training": 0.4,
-}
-
-# parameters of log-normal t1dexi starting glucose distribution
-mu = 4.93
-sigma = 0.34
-
-target_mins = list(np.arange(100, 180, 20))
-target_mins.append(150)
-target_mins.sort()
-target_labels = [f"{v}-{v+20}" for v in target_mins]
-sample_points = [
-    0.25,
-    0.4,
-    0.6,
-    0.8,
-    1.0,
-]  # sample points for the target-based color map
-colors = sample_colorscale("Blues", sample_points)
-color_map = dict(zip(target_labels, colors))
+background_manager = None
+if BACKGROUND_CALLBACKS:
+    from background import make_manager
+
+    background_manager = make_manager(BACKGROUND_CACHE_DIR, BACKGROUND_RESULT_TTL)
 
 # visualization app code
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+app = dash.Dash(
+    __name__,
+    external_stylesheets=[dbc.themes.BOOTSTRAP],
+    background_callback_manager=background_manager,
+)
 server = app.server
 
+
+def app_gauges():
+    figure_stats = figure_cache.stats()
+    return {
+        "rss_bytes": rss_bytes(),
+        "app_memory_bytes": app_memory_bytes(),
+        "memory_budget_bytes": int(MEMORY_BUDGET_MB * 2**20),
+        "memory_sheds": cache.sheds,
+        "low_memory_aggregates": pipeline.low_memory_aggregates,
+        "data_cache_bytes": data_cache.nbytes,
+        "data_cache_pinned_bytes": data_cache.stats()["pinned_bytes"],
+        "aggregate_cache_entries": len(aggregate_cache),
+        "figure_cache_entries": figure_stats["entries"],
+        "figure_cache_hits": figure_stats["hits"],
+        "figure_cache_misses": figure_stats["misses"],
+    }
+
+
+init_app(server, gauges=app_gauges)
+init_responses(server, assets_prefix=app.get_asset_url(""))
+
+
+@server.before_request
+def check_memory_budget():
+    # every view fills some cache (datasets, cubes, sketches, aggregates), so
+    # near the budget they are emptied before any callback runs; the row
+    # path checks again to decide whether to stream
+    if flask.request.path.endswith("_dash-update-component"):
+        memory_pressure()
+
+
 app.layout = dbc.Container(
     [
         dbc.Row(
@@ -137,7 +169,7 @@ app.layout = dbc.Container(
                                 },
                             ),
                             html.Img(
-                                src="/assets/ucsb-white.png",
+                                src=asset_url(app, "ucsb-white.png"),
                                 style={
                                     "width": "160px",
                                     "height": "14px",
@@ -259,12 +291,36 @@ app.layout = dbc.Container(
                     ],
                     width=2,
                 ),
-                dbc.Col(width=3),
+                dbc.Col(
+                    [
+                        dbc.Label("Plot", className="label-white"),
+                        dcc.Dropdown(
+                            id="view-dropdown",
+                            options=[
+                                {"label": "Means", "value": "means"},
+                                {
+                                    "label": "Means with 95% Bootstrap CI",
+                                    "value": "bootstrap",
+                                },
+                                {
+                                    "label": "Distribution of Y",
+                                    "value": "distribution",
+                                },
+                            ],
+                            value="means",
+                            clearable=False,
+                            # the clientside renderer draws the means only
+                            disabled=CLIENTSIDE_RENDERING,
+                        ),
+                    ],
+                    width=2,
+                ),
+                dbc.Col(width=1),
                 dbc.Col(
                     html.Div(
                         [
                             html.Img(
-                                src="/assets/pavia-white.png",
+                                src=asset_url(app, "pavia-white.png"),
                                 style={
                                     "width": "100px",
                                     # "height": "12px",
@@ -351,12 +407,30 @@ app.layout = dbc.Container(
                     ],
                     width=2,
                 ),
-                dbc.Col(width=3),
+                dbc.Col(
+                    [
+                        dbc.Label("Compare Across", className="label-white"),
+                        dcc.Dropdown(
+                            id="facet-dropdown",
+                            options=[
+                                {"label": "Activities", "value": "activity"},
+                                {"label": "Activity Durations", "value": "pa_duration"},
+                                {"label": "Noise Levels", "value": "noise"},
+                            ],
+                            value=None,
+                            placeholder="No comparison",
+                            # the clientside renderer draws single plots only
+                            disabled=CLIENTSIDE_RENDERING,
+                        ),
+                    ],
+                    width=2,
+                ),
+                dbc.Col(width=1),
                 dbc.Col(
                     html.Div(
                         [
                             html.Img(
-                                src="/assets/stanford-medicine-white.png",
+                                src=asset_url(app, "stanford-medicine-white.png"),
                                 style={
                                     "width": "160px",
                                     "height": "22px",
@@ -418,12 +492,55 @@ app.layout = dbc.Container(
                     ],
                     width=2,
                 ),
-                dbc.Col(width=5),
+                dbc.Col(
+                    [
+                        dbc.Label("Glucose Weighting", className="label-white"),
+                        dcc.Dropdown(
+                            id="weighting-dropdown",
+                            options=[
+                                {"label": label, "value": name}
+                                for name, (label, _, _) in distributions.items()
+                            ],
+                            value=DEFAULT_WEIGHTING[0],
+                            clearable=False,
+                        ),
+                    ],
+                    width=2,
+                ),
+                dbc.Col(
+                    [
+                        dbc.Label("Weighting μ, σ", className="label-white"),
+                        html.Div(
+                            [
+                                dcc.Input(
+                                    id="weight-p1-input",
+                                    type="number",
+                                    value=DEFAULT_WEIGHTING[1],
+                                    step="any",
+                                    debounce=True,
+                                    className="form-control",
+                                ),
+                                dcc.Input(
+                                    id="weight-p2-input",
+                                    type="number",
+                                    value=DEFAULT_WEIGHTING[2],
+                                    min=0.001,  # invalid values are sent as None
+                                    step="any",
+                                    debounce=True,
+                                    className="form-control",
+                                ),
+                            ],
+                            style={"display": "flex", "gap": "0.5rem"},
+                        ),
+                    ],
+                    width=2,
+                ),
+                dbc.Col(width=1),
                 dbc.Col(
                     html.Div(
                         [
                             html.Img(
-                                src="/assets/tidepool-white.png",
+                                src=asset_url(app, "tidepool-white.png"),
                                 style={
                                     "width": "140px",
                                     "height": "16px",
@@ -431,7 +548,7 @@ app.layout = dbc.Container(
                                 },
                             ),
                             html.Img(
-                                src="/assets/yorku-white.png",
+                                src=asset_url(app, "yorku-white.png"),
                                 style={
                                     "width": "120px",
                                     # "height": "10px",
@@ -447,8 +564,16 @@ app.layout = dbc.Container(
             ],
             className="ms-5 mt-2",
         ),
+        dcc.Store(id="aggregate-store"),
+        dcc.Store(
+            id="figure-style",
+            data=clientside_style() if CLIENTSIDE_RENDERING else None,
+        ),
         dbc.Col(
-            dcc.Graph(id="scatter-plot", style={"height": "500px"}),
+            [
+                html.Div(id="aggregate-status", className="label-white"),
+                dcc.Graph(id="scatter-plot", style={"height": "500px"}),
+            ],
             width=10,
             className="ms-5 mt-5",
         ),
@@ -457,230 +582,174 @@ app.layout = dbc.Container(
 )
 
 
-@app.callback(
-    Output("scatter-plot", "figure"),
+data_inputs = [
     Input("activity-dropdown", "value"),
     Input("duration-dropdown", "value"),
     Input("noise-dropdown", "value"),
-    Input("x-metric-dropdown", "value"),
-    Input("y-metric-dropdown", "value"),
     Input("max-netiob-dropdown", "value"),
     Input("averaging-dropdown", "value"),
     Input("min-glucose-dropdown", "value"),
     Input("max-glucose-dropdown", "value"),
     Input("eval-start-dropdown", "value"),
     Input("eval-end-dropdown", "value"),
+    Input("weighting-dropdown", "value"),
+    Input("weight-p1-input", "value"),
+    Input("weight-p2-input", "value"),
+    Input("facet-dropdown", "value"),
+]  # inputs that change the aggregated data
+axis_inputs = [
+    Input("x-metric-dropdown", "value"),
+    Input("y-metric-dropdown", "value"),
+]
+
+
+@app.callback(
+    Output("weight-p1-input", "value"),
+    Output("weight-p2-input", "value"),
+    Output("weight-p1-input", "disabled"),
+    Output("weight-p2-input", "disabled"),
+    Input("weighting-dropdown", "value"),
+    prevent_initial_call=True,
 )
-def update_plot(
-    selected_activity,
-    pa_duration,
-    noise,
-    x_metric,
-    y_metric,
-    max_netiob,
-    averaging,
-    min_glucose,
-    max_glucose,
-    eval_start,
-    eval_end,
-):
-    if noise == "all":
-        all_dfs = []
-        for noise_level in ["nonoise", "samplednoise", "fullnoise"]:
-            df = pd.read_csv(
-                f"./data/03_13_{noise_level}_{eval_start}_{eval_end}.csv",
-                names=col_names,
-                header=None,
-            )
-            df["noise"] = noise_level
-            all_dfs.append(df)
-        df = pd.concat(all_dfs, ignore_index=True)
-    else:
-        df = pd.read_csv(
-            f"./data/03_13_{noise}_{eval_start}_{eval_end}.csv",
-            names=col_names,
-            header=None,
-        )
-    df["activity"] = df["activity"].replace(
-        "rength training", "strength training"
-    )  # fix typo in results df
-    df["weight"] = lognorm.pdf(
-        np.array(df["starting_glucose"]), s=sigma, scale=np.exp(mu)
-    )  # weight of each simulation based on starting glucose
-    df["label"] = df.apply(
-        lambda x: f"Target: {x['target_min']}-{x['target_max']}\nPreset: {int(x['preset']*100)}%",
-        axis=1,
-    )  # label to display in the plot
-
-    # filter df based on set parameters in the visualization.
-    df_filtered = df[
-        (df["activity"] == selected_activity)
-        & (df["netIoB"] <= max_netiob)
-        & ((df["pa_duration"] == pa_duration) if pa_duration != "all" else True)
-        & (df["starting_glucose"] >= min_glucose)
-        & (df["starting_glucose"] <= max_glucose)
-        & (df["target_min"] < 180)
-    ]
-
-    df_filtered = df_filtered[
-        metrics_list + ["label", "weight", "target_min", "preset"]
-    ]
-
-    if averaging == "Unweighted":
-        df_avg = (
-            df_filtered.groupby(["label", "target_min", "preset"], as_index=False)
-            .mean()
-            .reset_index()
-        )
-    else:
-        df_avg = (
-            df_filtered.groupby(["label", "target_min", "preset"], as_index=False)
-            .apply(
-                lambda g: pd.Series(
-                    np.average(
-                        g.drop(columns=["label", "weight", "target_min", "preset"]),
-                        weights=g["weight"],
-                        axis=0,
-                    ),
-                    index=g.drop(
-                        columns=["label", "weight", "target_min", "preset"]
-                    ).columns,
-                )
-            )
-            .reset_index()
-        )
+def reset_weighting_params(weighting):
+    # parameters of one distribution are meaningless for another
+    p1, p2 = distributions[weighting][2]
+    return p1, p2, p1 is None, p2 is None
 
-    df_avg["Target"] = df_avg.apply(
-        lambda x: f"{x['target_min']}-{x['target_min']+20}", axis=1
-    )
-    df_avg["size"] = (
-        df_avg["preset"] * 100
-    )  # for setting the size of the scatter points based on the preset
-
-    df_avg = df_avg.round(2)
-
-    fig = px.scatter(
-        df_avg,
-        x=x_metric,
-        y=y_metric,
-        color="Target",
-        color_discrete_map=color_map,
-        size="size",
-        size_max=18,
-        opacity=0.75,
-        title=f"{y_metric} vs {x_metric} for {selected_activity}",
-        hover_data={"label": True, "size": False, "Target": False},
-    )
 
-    # highlight the baseline : default target and 100% preset
-    baseline_df = df_avg[(df_avg["Target"] == "100-120") & (df_avg["preset"] == 1.0)]
-    fig.add_trace(
-        go.Scatter(
-            x=baseline_df[x_metric],
-            y=baseline_df[y_metric],
-            name="No Action<br><sub>Default target 100-120, Preset 100%</sub>",
-            mode="markers",
-            marker=dict(symbol="diamond", color="#A1BB97", size=14, line=dict(width=0)),
-            customdata=baseline_df[["label"]],
-            hovertemplate=(
-                f"{x_metric}: {baseline_df[x_metric].iloc[0]:.2f}<br>"
-                f"{y_metric}: {baseline_df[y_metric].iloc[0]:.2f}<br>"
-                "%{customdata[0]}<extra></extra>"
-            ),
-            showlegend=True,
-        )
-    )
+def update_aggregate(*inputs):
+    noise, eval_start, eval_end = inputs[2], inputs[7], inputs[8]
+    version = dataset_version(noise, eval_start, eval_end)
+    df_avg = get_aggregate(inputs, version)  # computed into the server-side store
+    aggregate = {"inputs": inputs, "version": version}
+    if CLIENTSIDE_RENDERING or BACKGROUND_CALLBACKS:
+        # plotted in the browser, or computed in a background process whose
+        # store the figure callback cannot see
+        aggregate["table"] = df_avg.to_dict("list")
+    return aggregate
 
-    # highlight the raised target with 100% preset point
-    raised_target_df = df_avg[
-        (df_avg["Target"] == "150-170") & (df_avg["preset"] == 1.0)
-    ]
-    fig.add_trace(
-        go.Scatter(
-            x=raised_target_df[x_metric],
-            y=raised_target_df[y_metric],
-            name="Raised Target<br><sub>Target 150-170, Preset 100%</sub>",
-            mode="markers",
-            marker=dict(symbol="diamond", color="#E5CFA4", size=14, line=dict(width=0)),
-            customdata=raised_target_df[["label"]],
-            hovertemplate=(
-                f"{x_metric}: {raised_target_df[x_metric].iloc[0]:.2f}<br>"
-                f"{y_metric}: {raised_target_df[y_metric].iloc[0]:.2f}<br>"
-                "%{customdata[0]}<extra></extra>"
-            ),
-            showlegend=True,
-        )
-    )
 
-    # highlight the preset only data point
-    preset_only_df = df_avg[
-        (df_avg["preset"] == t1dexi_presets[selected_activity])
-        & (df_avg["Target"] == "100-120")
-    ]
-    fig.add_trace(
-        go.Scatter(
-            x=preset_only_df[x_metric],
-            y=preset_only_df[y_metric],
-            name=f"Preset Only<br><sub>Default target 100-120, T1DEXI Preset {int(t1dexi_presets[selected_activity]*100)}%</sub>",
-            mode="markers",
-            marker=dict(symbol="star", color="#D4938B", size=18, line=dict(width=0)),
-            customdata=preset_only_df[["label"]],
-            hovertemplate=(
-                f"{x_metric}: {preset_only_df[x_metric].iloc[0]:.2f}<br>"
-                f"{y_metric}: {preset_only_df[y_metric].iloc[0]:.2f}<br>"
-                "%{customdata[0]}<extra></extra>"
-            ),
-            showlegend=True,
-        )
-    )
+# in background mode the browser cancels the job of a superseded request (the
+# renderer passes it as oldJob with the next one), and the running outputs
+# show that the plot is being updated
+app.callback(
+    Output("aggregate-store", "data"),
+    *data_inputs,
+    background=BACKGROUND_CALLBACKS,
+    running=[
+        (Output("aggregate-status", "children"), "Updating the plot…", ""),
+        (Output("scatter-plot", "className"), "updating", ""),
+    ],
+)(update_aggregate)
+
 
-    # highlight the raised target + T1DEXI preset point
-    preset_and_raised_target_df = df_avg[
-        (df_avg["Target"] == "150-170")
-        & (df_avg["preset"] == t1dexi_presets[selected_activity])
-    ]
-    fig.add_trace(
-        go.Scatter(
-            x=preset_and_raised_target_df[x_metric],
-            y=preset_and_raised_target_df[y_metric],
-            name=f"Preset + Raised Target<br><sub>Target 150-170, Preset {int(t1dexi_presets[selected_activity]*100)}%</sub>",
-            mode="markers",
-            marker=dict(symbol="star", color="pink", size=18, line=dict(width=0)),
-            customdata=preset_and_raised_target_df[["label"]],
-            hovertemplate=(
-                f"{x_metric}: {preset_and_raised_target_df[x_metric].iloc[0]:.2f}<br>"
-                f"{y_metric}: {preset_and_raised_target_df[y_metric].iloc[0]:.2f}<br>"
-                "%{customdata[0]}<extra></extra>"
-            ),
-            showlegend=True,
+def aggregate_frame(aggregate):
+    """The aggregate of an aggregate-store value."""
+    if "table" in aggregate:
+        return pd.DataFrame(aggregate["table"])
+    return get_aggregate(aggregate["inputs"], aggregate["version"])
+
+
+def means_figure(aggregate, x_metric, y_metric, intervals=False):
+    inputs, version = aggregate["inputs"], aggregate["version"]
+    df_avg = aggregate_frame(aggregate)
+    facet = inputs[12]
+    if intervals:
+        df_ci = get_intervals(
+            inputs, version, list(dict.fromkeys([x_metric, y_metric]))
         )
-    )
+        keys = ["target_min", "preset"] + (["facet"] if facet else [])
+        df_avg = df_avg.merge(df_ci, on=keys, how="left")
+    with stage("figure"):
+        if facet is None:
+            return build_figure(df_avg, inputs[0], x_metric, y_metric)
+        return build_facet_figure(df_avg, facet, inputs[0], x_metric, y_metric)
 
-    # update plot aesthetics
-    fig.update_layout(
-        paper_bgcolor="#0F203A",
-        font=dict(family="Basis Grotesque Pro", color="white"),
-        title_font=dict(size=20, color="white"),
-        legend=dict(
-            title=dict(
-                text="Key [Target]",  # Your custom legend title
-                font=dict(family="Basis Grotesque Pro", size=16, color="white"),
-            ),
-            bordercolor="white",
-            borderwidth=1,
-            font=dict(family="Basis Grotesque Pro", color="white", size=16),
-            x=1.05,
-            y=0.5,
-            xanchor="left",
-            yanchor="middle",
-            # itemclick="toggleothers",
-        ),
-        margin=dict(l=50, r=300, t=50, b=50),
-        legend_tracegroupgap=4,
+
+def update_plot(aggregate, x_metric, y_metric, view="means"):
+    if aggregate is None:
+        raise PreventUpdate
+    inputs, version = aggregate["inputs"], aggregate["version"]
+    key = make_key([*inputs, x_metric, y_metric, view], version)
+    if set_etag(key):
+        raise PreventUpdate  # the browser has this figure, answered with a 304
+    figure = figure_cache.get(key)
+    if figure is None:
+        if view == "distribution":
+            df_q = get_distribution(inputs, version, y_metric)
+            with stage("figure"):
+                fig = build_distribution_figure(df_q, inputs[0], y_metric)
+        else:
+            fig = means_figure(aggregate, x_metric, y_metric, view == "bootstrap")
+        with stage("serialize"):
+            figure = figure_cache.put(key, figure_json(fig))
+    return figure_loads(figure)
+
+
+@app.callback(
+    Output("x-metric-dropdown", "disabled"),
+    Output("facet-dropdown", "disabled"),
+    Input("view-dropdown", "value"),
+)
+def disable_view_controls(view):
+    # the distribution view plots y only, in a single plot
+    distribution = view == "distribution"
+    return distribution, CLIENTSIDE_RENDERING or distribution
+
+
+if CLIENTSIDE_RENDERING:
+    app.clientside_callback(
+        ClientsideFunction(namespace="t1d", function_name="buildFigure"),
+        Output("scatter-plot", "figure"),
+        Input("aggregate-store", "data"),
+        *axis_inputs,
+        State("figure-style", "data"),
     )
+else:
+    app.callback(
+        Output("scatter-plot", "figure"),
+        Input("aggregate-store", "data"),
+        *axis_inputs,
+        Input("view-dropdown", "value"),
+    )(update_plot)
+
+
+def default_values(inputs):
+    """Initial values of the callback inputs, as set in the layout."""
+    values = {
+        component.id: component.value
+        for component in app.layout._traverse()
+        if hasattr(component, "id") and hasattr(component, "value")
+    }
+    return [values[i.component_id] for i in inputs]
 
-    return fig
 
+def prewarm_default_figure():
+    # most users land on the default view; build it before their first request
+    try:
+        with startup_phase("prewarm"):
+            aggregate = update_aggregate(*default_values(data_inputs))
+            if not CLIENTSIDE_RENDERING:
+                update_plot(aggregate, *default_values(axis_inputs))
+    except FileNotFoundError as e:
+        print(f"not prewarming the default figure: {e}")
+
+
+record_startup("app", time.perf_counter() - app_started)
+prewarm_thread = None
+if PRELOAD_DATASETS:
+    # in the gunicorn master, which forks the workers once the app is
+    # imported: load and warm everything now, threads don't survive the fork
+    with startup_phase("preload"):
+        preload_datasets()
+    prewarm_default_figure()
+else:
+    # serve the first page right away and warm the default view meanwhile
+    prewarm_thread = threading.Thread(
+        target=prewarm_default_figure, name="prewarm", daemon=True
+    )
+    prewarm_thread.start()
+record_startup("ready", time.perf_counter() - started)
 
 if __name__ == "__main__":
     app.run(debug=True)
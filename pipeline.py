@@ -0,0 +1,439 @@
+"""Aggregation stage of the plot: filtered, averaged results per intervention.
+
+The aggregate holds every column of metrics_list, so it only depends on the
+data-affecting inputs and is shared by all x/y metric choices.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from aggregation import (
+    GroupSums,
+    bootstrap_intervals,
+    group_codes,
+    group_means,
+    intervention_labels,
+    target_labels,
+)
+from cache import LRUCache, memory_pressure
+from config import metrics_list, noise_levels
+from datasets import get_cube, get_sketch, select_results
+from instrumentation import stage
+from sketch import weighted_quantiles
+from store import iter_results
+from weighting import (
+    DEFAULT_WEIGHTING,
+    glucose_weights,
+    weight_table,
+    weighting_params,
+)
+
+# keys the results can be compared across, side by side
+facet_keys = ["activity", "pa_duration", "noise"]
+
+# memory budget of the server-side aggregate store, in MB
+AGGREGATE_CACHE_MB = float(os.environ.get("AGGREGATE_CACHE_MB", 16))
+
+aggregate_cache = LRUCache(max_bytes=int(AGGREGATE_CACHE_MB * 2**20))
+
+# when set, datasets are aggregated in chunks of this many rows instead of
+# being loaded whole, bounding memory for results larger than RAM
+STREAMING_CHUNK_ROWS = int(os.environ.get("STREAMING_CHUNK_ROWS", 0))
+# chunk size of the streaming path when it is taken to stay under the memory
+# budget (cache.MEMORY_BUDGET_MB)
+LOW_MEMORY_CHUNK_ROWS = 100_000
+
+low_memory_aggregates = 0  # aggregates streamed because of the memory budget
+
+# resamples of the bootstrap confidence intervals; the seed is fixed so that
+# the intervals of a view are the same on every request
+BOOTSTRAP_RESAMPLES = int(os.environ.get("BOOTSTRAP_RESAMPLES", 1000))
+BOOTSTRAP_SEED = 0
+# the bootstrap runs in the figure request: views with more simulations
+# (comparisons) get fewer resamples, so that rows x resamples stays under
+# this, but at least BOOTSTRAP_MIN_RESAMPLES
+BOOTSTRAP_MAX_DRAWS = int(os.environ.get("BOOTSTRAP_MAX_DRAWS", 25_000_000))
+BOOTSTRAP_MIN_RESAMPLES = 200
+
+
+# quantiles of the distribution view, and the names of their columns
+DISTRIBUTION_QUANTILES = {
+    "p1": 0.01,
+    "p10": 0.1,
+    "p25": 0.25,
+    "median": 0.5,
+    "p75": 0.75,
+    "p90": 0.9,
+    "p99": 0.99,
+}
+
+
+def filter_mask(
+    df, selected_activity, pa_duration, max_netiob, min_glucose, max_glucose
+):
+    """Rows matching the filters set in the visualization."""
+    return (
+        ((df["activity"] == selected_activity) if selected_activity != "all" else True)
+        & (df["netIoB"] <= max_netiob)
+        & ((df["pa_duration"] == pa_duration) if pa_duration != "all" else True)
+        & (df["starting_glucose"] >= min_glucose)
+        & (df["starting_glucose"] <= max_glucose)
+        & (df["target_min"] < 180)
+    )
+
+
+def label_means(df_avg, facet=None):
+    """Replace target_max of per-intervention means by the display label.
+
+    Grouping is done on the numeric keys, the labels are only joined onto the
+    aggregated rows, which are returned in (facet and) label order.
+    """
+    labels = intervention_labels(
+        df_avg["target_min"], df_avg["target_max"], df_avg["preset"]
+    )
+    df_avg.insert(0, "label", np.asarray(labels))
+    df_avg = df_avg.drop(columns="target_max")
+    order = ["label", "target_min", "preset"]
+    if facet is not None:
+        order.insert(0, facet)
+    return df_avg.sort_values(order, ignore_index=True)
+
+
+def group_keys(facet=None):
+    keys = ["target_min", "target_max", "preset"]
+    return keys if facet is None else [facet] + keys
+
+
+def stream_group_means(
+    selected_activity,
+    pa_duration,
+    noise,
+    max_netiob,
+    averaging,
+    min_glucose,
+    max_glucose,
+    eval_start,
+    eval_end,
+    weighting=DEFAULT_WEIGHTING,
+    facet=None,
+    chunk_rows=STREAMING_CHUNK_ROWS,
+):
+    """group_means of the filtered results, reading the files chunk by chunk."""
+    filters = (selected_activity, pa_duration, max_netiob, min_glucose, max_glucose)
+    sums = GroupSums(group_keys(facet), metrics_list)
+    levels = noise_levels if noise == "all" else [noise]
+    for noise_level in levels:
+        for chunk in iter_results(noise_level, eval_start, eval_end, chunk_rows):
+            with stage("filter"):
+                chunk = chunk[filter_mask(chunk, *filters)]
+            with stage("aggregate"):
+                weights = None
+                if averaging == "Weighted":
+                    weights = glucose_weights(chunk["starting_glucose"], *weighting)
+                sums.add(chunk, weights)
+    return label_means(sums.means(), facet)
+
+
+def low_memory():
+    """True if the rows should be streamed to stay under the memory budget."""
+    global low_memory_aggregates
+    if memory_pressure():
+        low_memory_aggregates += 1
+        return True
+    return False
+
+
+def lift_facet(facet, selected_activity, pa_duration, noise):
+    """(selected_activity, pa_duration, noise) with the filter on facet lifted."""
+    if facet is None:
+        return selected_activity, pa_duration, noise
+    if facet not in facet_keys:
+        raise ValueError(f"unknown facet {facet!r}")
+    if facet == "activity":
+        return "all", pa_duration, noise
+    if facet == "pa_duration":
+        return selected_activity, "all", noise
+    return selected_activity, pa_duration, "all"
+
+
+def aggregate_results(
+    selected_activity,
+    pa_duration,
+    noise,
+    max_netiob,
+    averaging,
+    min_glucose,
+    max_glucose,
+    eval_start,
+    eval_end,
+    weighting="lognormal",
+    weight_p1=None,
+    weight_p2=None,
+    facet=None,
+):
+    """Per-intervention means of the filtered results.
+
+    Weighted averages weight the simulations by their starting glucose under
+    the given distribution of weighting.distributions and its two parameters
+    (the defaults when None).
+
+    With facet, one of facet_keys, the filter on that key is lifted and the
+    means are computed per value of it as well, in the same grouped pass. The
+    value is returned in a "facet" column.
+    """
+    weighting = weighting_params(weighting, weight_p1, weight_p2)
+    selected_activity, pa_duration, noise = lift_facet(
+        facet, selected_activity, pa_duration, noise
+    )
+    cube = None if facet is not None else get_cube(noise, eval_start, eval_end)
+    if cube is not None:
+        # answer from the pre-aggregated cube built by `store.py ingest`
+        weights = None
+        if weighting != DEFAULT_WEIGHTING:
+            weights = weight_table(cube.axes["starting_glucose"], *weighting)
+        with stage("cube_query"):
+            df_avg = cube.query(
+                selected_activity,
+                pa_duration,
+                max_netiob,
+                min_glucose,
+                max_glucose,
+                weighted=averaging == "Weighted",
+                weights=weights,
+            )
+            df_avg = df_avg[df_avg["target_min"] < 180].reset_index(drop=True)
+    elif STREAMING_CHUNK_ROWS or low_memory():
+        df_avg = stream_group_means(
+            selected_activity,
+            pa_duration,
+            noise,
+            max_netiob,
+            averaging,
+            min_glucose,
+            max_glucose,
+            eval_start,
+            eval_end,
+            weighting,
+            facet,
+            chunk_rows=STREAMING_CHUNK_ROWS or LOW_MEMORY_CHUNK_ROWS,
+        )
+    else:
+        # rows matching the filters set in the visualization, as slices of
+        # the sorted dataset(s)
+        df_filtered = select_results(
+            noise,
+            eval_start,
+            eval_end,
+            selected_activity,
+            pa_duration,
+            max_netiob,
+            min_glucose,
+            max_glucose,
+        )
+
+        with stage("aggregate"):
+            weights = None
+            if averaging == "Weighted":
+                weights = glucose_weights(df_filtered["starting_glucose"], *weighting)
+            df_avg = group_means(df_filtered, group_keys(facet), metrics_list, weights)
+            df_avg = label_means(df_avg, facet)
+            # the groups are per target_min, so this drops the same rows as
+            # filtering them before averaging
+            df_avg = df_avg[df_avg["target_min"] < 180].reset_index(drop=True)
+
+    if facet is not None:
+        df_avg = df_avg.rename(columns={facet: "facet"})
+    df_avg["Target"] = target_labels(df_avg["target_min"])
+    df_avg["size"] = (
+        df_avg["preset"] * 100
+    )  # for setting the size of the scatter points based on the preset
+
+    df_avg = df_avg.round(2)
+
+    return df_avg
+
+
+def bootstrap_results(
+    selected_activity,
+    pa_duration,
+    noise,
+    max_netiob,
+    averaging,
+    min_glucose,
+    max_glucose,
+    eval_start,
+    eval_end,
+    weighting="lognormal",
+    weight_p1=None,
+    weight_p2=None,
+    facet=None,
+    metrics=metrics_list,
+    confidence=0.95,
+):
+    """Bootstrap confidence intervals of the aggregate_results means of metrics.
+
+    The simulations of every intervention (and facet value) are resampled
+    with the weights of the means, BOOTSTRAP_RESAMPLES times or fewer for
+    views with many simulations (see bootstrap_resamples). Returns the
+    target_min and preset (and "facet") of each group with a "<metric> lo"
+    and "<metric> hi" column per metric. The resampling needs the individual
+    simulations, so the rows are always selected from the datasets, also
+    when a cube could answer the means.
+    """
+    weighting = weighting_params(weighting, weight_p1, weight_p2)
+    selected_activity, pa_duration, noise = lift_facet(
+        facet, selected_activity, pa_duration, noise
+    )
+    # near the memory budget, empty the caches: resampling needs the rows anyway
+    memory_pressure()
+    df_filtered = select_results(
+        noise,
+        eval_start,
+        eval_end,
+        selected_activity,
+        pa_duration,
+        max_netiob,
+        min_glucose,
+        max_glucose,
+    )
+    with stage("bootstrap"):
+        df_filtered = df_filtered[df_filtered["target_min"] < 180]
+        keys = ["target_min", "preset"]
+        if facet is not None:
+            keys.insert(0, facet)
+        inverse, groups = group_codes(df_filtered, keys)
+        weights = None
+        if averaging == "Weighted":
+            weights = glucose_weights(df_filtered["starting_glucose"], *weighting)
+        lo, hi = bootstrap_intervals(
+            df_filtered[metrics].to_numpy(dtype=np.float64),
+            inverse,
+            len(groups),
+            weights,
+            n_resamples=bootstrap_resamples(len(df_filtered)),
+            confidence=confidence,
+            seed=BOOTSTRAP_SEED,
+        )
+        for j, metric in enumerate(metrics):
+            groups[f"{metric} lo"] = lo[:, j]
+            groups[f"{metric} hi"] = hi[:, j]
+    if facet is not None:
+        groups = groups.rename(columns={facet: "facet"})
+    return groups.round(2)
+
+
+def bootstrap_resamples(n_rows):
+    """Resamples of a bootstrap of n_rows simulations, see BOOTSTRAP_MAX_DRAWS."""
+    resamples = BOOTSTRAP_MAX_DRAWS // max(n_rows, 1)
+    return max(BOOTSTRAP_MIN_RESAMPLES, min(BOOTSTRAP_RESAMPLES, resamples))
+
+
+def distribution_results(
+    selected_activity,
+    pa_duration,
+    noise,
+    max_netiob,
+    averaging,
+    min_glucose,
+    max_glucose,
+    eval_start,
+    eval_end,
+    weighting="lognormal",
+    weight_p1=None,
+    weight_p2=None,
+    facet=None,
+    metric=metrics_list[0],
+    quantiles=DISTRIBUTION_QUANTILES,
+):
+    """Per-intervention (weighted) quantiles of metric under the filters.
+
+    Merged from the quantile sketches of the selected grid cells, with the
+    same weights as aggregate_results. Returns target_min, preset, Target and
+    a column per entry of quantiles (name -> quantile). facet is ignored, the
+    distribution view is a single plot.
+    """
+    weighting = weighting_params(weighting, weight_p1, weight_p2)
+    filters = (selected_activity, pa_duration, max_netiob, min_glucose, max_glucose)
+    levels = noise_levels if noise == "all" else [noise]
+    pieces = []
+    for noise_level in levels:
+        sketch = get_sketch(noise_level, eval_start, eval_end)
+        with stage("sketch_query"):
+            target_min, preset, glucose, means, counts = sketch.centroids(
+                *filters, metric
+            )
+            weights = counts.astype(np.float64)
+            if averaging == "Weighted":
+                table = weight_table(sketch.axes["starting_glucose"], *weighting)
+                weights *= table[glucose]
+            pieces.append((target_min, preset, means, weights))
+    with stage("sketch_query"):
+        target_min, preset, means, weights = (np.concatenate(a) for a in zip(*pieces))
+        keys = pd.DataFrame({"target_min": target_min, "preset": preset})
+        inverse, groups = group_codes(keys, ["target_min", "preset"])
+        values = weighted_quantiles(
+            inverse,
+            means.astype(np.float64),
+            weights,
+            len(groups),
+            list(quantiles.values()),
+        )
+        for j, name in enumerate(quantiles):
+            groups[name] = values[:, j]
+        groups = groups[groups["target_min"] < 180].reset_index(drop=True)
+    groups["Target"] = target_labels(groups["target_min"])
+    return groups.round(2)
+
+
+def get_aggregate(inputs, version):
+    """Aggregate for the data inputs, from the store or freshly computed.
+
+    Each worker process keeps its own store, so a worker that did not compute
+    an aggregate itself recomputes it on first use.
+    """
+    key = tuple(inputs)
+    df_avg = aggregate_cache.get(key, version)
+    if df_avg is None:
+        df_avg = aggregate_results(*inputs)
+        aggregate_cache.put(key, df_avg, version)
+    return df_avg
+
+
+def get_intervals(inputs, version, metrics):
+    """bootstrap_results of metrics for the data inputs, from the store or computed.
+
+    The intervals are stored per metric, so changing one axis only resamples
+    the new metric. The resampled rows don't depend on the metrics, so the
+    intervals of a metric are the same whichever metrics it is computed with.
+    """
+    stored = {
+        metric: aggregate_cache.get(("bootstrap", *inputs, metric), version)
+        for metric in metrics
+    }
+    missing = [metric for metric, df in stored.items() if df is None]
+    if missing:
+        intervals = bootstrap_results(*inputs, metrics=missing)
+        keys = [c for c in intervals.columns if not c.endswith((" lo", " hi"))]
+        for metric in missing:
+            stored[metric] = aggregate_cache.put(
+                ("bootstrap", *inputs, metric),
+                intervals[keys + [f"{metric} lo", f"{metric} hi"]],
+                version,
+            )
+    frames = list(stored.values())
+    keys = [c for c in frames[0].columns if not c.endswith((" lo", " hi"))]
+    return pd.concat(
+        [frames[0][keys]] + [df.drop(columns=keys) for df in frames], axis=1
+    )
+
+
+def get_distribution(inputs, version, metric):
+    """distribution_results of metric for the data inputs, from the store or computed."""
+    key = ("distribution", *inputs, metric)
+    df_q = aggregate_cache.get(key, version)
+    if df_q is None:
+        df_q = distribution_results(*inputs, metric=metric)
+        aggregate_cache.put(key, df_q, version)
+    return df_q
@@ -0,0 +1,104 @@
+"""HTTP-level savings on the Flask server: compression, ETags and asset caching.
+
+* The JSON responses of the Dash endpoints (callbacks, layout, dependencies)
+  are compressed with brotli when the client accepts it and brotli is
+  installed, with gzip otherwise.
+* Callbacks can tag their response with an ETag (see ``set_etag``), e.g. the
+  figure cache key, and skip their work when the request's If-None-Match
+  already names it; the response is then a bodiless 304. Browsers don't
+  revalidate POST requests on their own, so ``assets/etag.js`` keeps the last
+  callback responses and sends their ETags.
+* Assets requested with a ``?m=<mtime>`` fingerprint, as Dash links the CSS
+  and JS in assets/ and ``asset_url`` the images, are cached as immutable.
+"""
+
+import gzip
+import os
+
+import flask
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is used without it
+    brotli = None
+
+# responses smaller than this are not worth compressing
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # fast enough to run on every callback response
+
+ASSET_MAX_AGE = 365 * 24 * 3600  # seconds
+
+compressed_paths = ("_dash-update-component", "_dash-layout", "_dash-dependencies")
+
+
+def asset_url(app, name):
+    """URL of an asset with its mtime as the cache-busting fingerprint."""
+    path = os.path.join(app.config.assets_folder, name)
+    return f"{app.get_asset_url(name)}?m={int(os.path.getmtime(path))}"
+
+
+def set_etag(etag):
+    """Tag the current response; True if the client already has this version.
+
+    Callbacks that get True can skip building their output: the response is
+    replaced by a 304 either way. Outside of a request this is a no-op.
+    """
+    if not flask.has_request_context():
+        return False
+    etag = f'"{etag}"'
+    flask.g.etag = etag
+    return etag in flask.request.headers.get("If-None-Match", "")
+
+
+def accepted_encoding():
+    accepted = flask.request.headers.get("Accept-Encoding", "")
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(response):
+    if (
+        response.direct_passthrough
+        or response.status_code != 200
+        or "Content-Encoding" in response.headers
+        or not flask.request.path.endswith(compressed_paths)
+    ):
+        return response
+    encoding = accepted_encoding()
+    data = response.get_data()
+    if encoding is None or len(data) < COMPRESS_MIN_BYTES:
+        return response
+    if encoding == "br":
+        data = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        data = gzip.compress(data, compresslevel=GZIP_LEVEL)
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def init_app(server, assets_prefix="/assets/"):
+    """Add compression, ETag handling and immutable asset caching to the server."""
+
+    @server.after_request
+    def http_savings(response):
+        etag = flask.g.pop("etag", None)
+        if etag is not None:
+            if etag in flask.request.headers.get("If-None-Match", ""):
+                response = flask.Response(status=304)
+            response.headers["ETag"] = etag
+            response.headers["Cache-Control"] = "no-cache"
+        if (
+            flask.request.path.startswith(assets_prefix)
+            and "m" in flask.request.args
+            and response.status_code in (200, 304)
+        ):
+            response.headers["Cache-Control"] = (
+                f"public, max-age={ASSET_MAX_AGE}, immutable"
+            )
+        return compress(response)
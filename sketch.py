@@ -0,0 +1,173 @@
+"""Mergeable per-cell quantile sketches of the metrics.
+
+The sketch covers the same grid as the aggregate cube (see cube.py). Every
+cell keeps, per metric, at most SKETCH_SIZE centroids: the mean and count of
+a run of the cell's sorted values. Cells with up to SKETCH_SIZE simulations
+keep their values exactly; larger cells are compressed with the t-digest
+scale function k(q) = size * arccos(1 - 2q) / pi, which gives the tails of
+the distribution the smallest centroids. The centroids are stored cell after
+cell in grid order, so the cells selected by the app's filters are a few
+contiguous runs, and sketches merge by pooling their centroids. Weighted
+quantiles under the filters are then computed from the pooled centroids,
+with the starting glucose weight of a centroid's cell applied at query time.
+
+Quantiles of cells with up to SKETCH_SIZE simulations match the exact
+weighted quantiles of the rows. With larger cells they are approximate: in
+tests/test_sketch.py the 10th to 90th percentiles stay within 0.15 and the
+1st and 99th within 0.4 standard deviations of the metric.
+"""
+
+import numpy as np
+
+from config import metrics_list
+from cube import GLUCOSE_AXIS, axis_names, grid_codes
+
+SKETCH_FILE = "sketch.npz"
+SKETCH_SIZE = 16  # centroids per cell and metric
+
+
+class QuantileSketch:
+    def __init__(self, axes, offsets, means, counts, metrics=metrics_list):
+        self.axes = axes  # axis name -> sorted grid values
+        self.offsets = offsets  # first centroid of each cell, and the total
+        # arrays of shape (n_centroids, n_metrics); unused centroids (cells
+        # with missing values of a metric) have a count of 0
+        self.means = means
+        self.counts = counts
+        self.metrics = list(metrics)
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.means.nbytes + self.counts.nbytes
+
+    @classmethod
+    def from_frame(cls, df, metrics=metrics_list, size=SKETCH_SIZE):
+        axes, _, cell = grid_codes(df)
+        n_cells = int(np.prod([len(axes[name]) for name in axis_names]))
+        rows = np.bincount(cell, minlength=n_cells)
+        offsets = np.zeros(n_cells + 1, dtype=np.int64)
+        np.cumsum(np.minimum(rows, size), out=offsets[1:])
+        first_row = np.cumsum(rows) - rows
+        values = df[metrics].to_numpy(dtype=np.float64)
+        means = np.zeros((offsets[-1], len(metrics)), dtype=np.float32)
+        counts = np.zeros((offsets[-1], len(metrics)), dtype=np.float32)
+        for j in range(len(metrics)):
+            v = values[:, j]
+            order = np.lexsort((v, cell))  # by cell, then value, NaN last
+            c, v = cell[order], v[order]
+            present = ~np.isnan(v)
+            n = np.bincount(c, weights=present, minlength=n_cells)[c]
+            rank = np.arange(len(v)) - first_row[c]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                scaled = size * np.arccos(1 - 2 * (rank + 0.5) / n) / np.pi
+            slot = np.where(n <= size, rank, np.minimum(scaled, size - 1))
+            slot = offsets[c[present]] + slot[present].astype(np.int64)
+            counts[:, j] = np.bincount(slot, minlength=offsets[-1])
+            sums = np.bincount(slot, weights=v[present], minlength=offsets[-1])
+            with np.errstate(invalid="ignore", divide="ignore"):
+                means[:, j] = np.where(counts[:, j] > 0, sums / counts[:, j], 0)
+        return cls(axes, offsets, means, counts, metrics)
+
+    def save(self, path):
+        np.savez(
+            path,
+            offsets=self.offsets,
+            means=self.means,
+            counts=self.counts,
+            metrics=np.array(self.metrics),
+            **{f"axis_{name}": self.axes[name] for name in axis_names},
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            axes = {name: f[f"axis_{name}"] for name in axis_names}
+            return cls(
+                axes, f["offsets"], f["means"], f["counts"], f["metrics"].tolist()
+            )
+
+    def centroids(
+        self, activity, pa_duration, max_netiob, min_glucose, max_glucose, metric
+    ):
+        """Centroids of metric in the cells matching the filters.
+
+        Returns the (target_min, preset) grid values, the starting glucose
+        grid index, the mean and the count of every centroid.
+        """
+        axes = self.axes
+        if activity == "all":
+            a = np.arange(len(axes["activity"]))
+        else:
+            a = np.flatnonzero(axes["activity"] == activity)
+        if pa_duration == "all":
+            d = np.arange(len(axes["pa_duration"]))
+        else:
+            d = np.flatnonzero(axes["pa_duration"] == pa_duration)
+        n = np.arange(np.searchsorted(axes["netIoB"], max_netiob, side="right"))
+        glucose = axes["starting_glucose"]
+        g_lo = np.searchsorted(glucose, min_glucose, side="left")
+        g_hi = np.searchsorted(glucose, max_glucose, side="right") - 1
+        shape = tuple(len(axes[name]) for name in axis_names)
+        j = self.metrics.index(metric)
+        if len(a) == 0 or len(d) == 0 or len(n) == 0 or g_hi < g_lo:
+            empty = np.zeros(0)
+            return empty, empty, np.zeros(0, dtype=np.int64), empty, empty
+        # one run of cells per (activity, pa_duration, netIoB): the glucose
+        # range over all targets and presets
+        a, d, n = (x.ravel() for x in np.meshgrid(a, d, n, indexing="ij"))
+        first = np.ravel_multi_index((a, d, n, g_lo, 0, 0), shape)
+        last = np.ravel_multi_index(
+            (a, d, n, g_hi, shape[-2] - 1, shape[-1] - 1), shape
+        )
+        starts, stops = self.offsets[first], self.offsets[last + 1]
+        lengths = stops - starts
+        index = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        index += np.arange(len(index))
+        cell = np.searchsorted(self.offsets, index, side="right") - 1
+        grid = np.unravel_index(cell, shape)
+        return (
+            axes["target_min"][grid[-2]],
+            axes["preset"][grid[-1]],
+            grid[GLUCOSE_AXIS],
+            self.means[index, j],
+            self.counts[index, j],
+        )
+
+
+def weighted_quantiles(group, values, weights, n_groups, quantiles):
+    """Weighted quantiles of values per group, an (n_groups, n_quantiles) array.
+
+    Each value is a point mass at the middle of its share of the cumulative
+    weight of its group; quantiles between two of them are interpolated
+    linearly, quantiles beyond the outermost ones take their value. Groups
+    without weight get NaN.
+    """
+    quantiles = np.asarray(quantiles, dtype=float)
+    result = np.full((n_groups, len(quantiles)), np.nan)
+    keep = weights > 0
+    group, values, weights = group[keep], values[keep], weights[keep]
+    if len(values) == 0:
+        return result
+    order = np.lexsort((values, group))
+    group, values, weights = group[order], values[order], weights[order]
+    totals = np.bincount(group, weights=weights, minlength=n_groups)
+    sizes = np.bincount(group, minlength=n_groups)
+    ends = np.cumsum(sizes)
+    starts = ends - sizes
+    cumulative = np.cumsum(weights)
+    before = (cumulative - weights)[starts[group]]  # weight of earlier groups
+    # group + position of each value within its group, increasing overall
+    key = group + (cumulative - before - weights / 2) / totals[group]
+    groups = np.flatnonzero(sizes)
+    target = (groups[:, None] + quantiles[None, :]).ravel()
+    first = np.repeat(starts[groups], len(quantiles))
+    last = np.repeat(ends[groups], len(quantiles)) - 1
+    hi = np.clip(np.searchsorted(key, target, side="left"), first, last)
+    lo = np.clip(hi - 1, first, last)
+    span = key[hi] - key[lo]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        frac = np.clip(np.where(span > 0, (target - key[lo]) / span, 0), 0, 1)
+    result[groups] = (values[lo] + frac * (values[hi] - values[lo])).reshape(
+        len(groups), len(quantiles)
+    )
+    return result
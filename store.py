@@ -0,0 +1,257 @@
+"""Columnar, memory-mapped storage for the simulation results.
+
+The results CSVs are converted once (``python store.py ingest``) into one
+directory per noise x evaluation window, holding a ``.npy`` file per column
+with the rows sorted for the block index (see block_index.py), a
+``meta.json`` describing the columns, the block index, the aggregate cube
+(see cube.py) and the quantile sketches (see sketch.py).
+The app opens these with ``np.load(mmap_mode="r")`` so switching datasets
+costs a page-cache hit instead of a full text parse.
+"""
+
+import argparse
+import glob
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from block_index import INDEX_FILE, sort_results
+from cube import CUBE_FILE, AggregateCube
+from instrumentation import stage
+from sketch import SKETCH_FILE, QuantileSketch
+from config import (
+    DATA_DIR,
+    RESULTS_PREFIX,
+    SCHEMA_VERSION,
+    col_names,
+    dataset_store_path,
+    eval_ends,
+    eval_starts,
+    noise_levels,
+    results_csv_path,
+    results_schema,
+)
+
+META_FILE = "meta.json"
+
+
+def file_fingerprint(path):
+    """(mtime_ns, size) of a file, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def bytes_per_row(df):
+    return df.memory_usage(deep=True, index=False).sum() / max(len(df), 1)
+
+
+def apply_schema(df, source=""):
+    """Convert the columns to the dtypes of results_schema, checking they fit."""
+    missing = [col for col in results_schema if col not in df.columns]
+    if missing:
+        raise ValueError(f"{source}: missing columns {missing}")
+    for col, dtype in results_schema.items():
+        values = df[col]
+        if dtype == "category":
+            df[col] = values.astype("category")
+            continue
+        try:
+            converted = values.astype(dtype)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"{source}: column {col!r} is not {dtype}: {e}")
+        if (
+            np.issubdtype(converted.dtype, np.integer)
+            and not (converted == values).all()
+        ):
+            raise ValueError(f"{source}: values of column {col!r} don't fit {dtype}")
+        df[col] = converted
+    return df
+
+
+def clean_results(df, noise, source=""):
+    """Apply the fixes every results file needs after parsing."""
+    df["activity"] = df["activity"].replace(
+        "rength training", "strength training"
+    )  # fix typo in results df
+    df["noise"] = noise
+    return apply_schema(df, source)
+
+
+def parse_results_csv(noise, eval_start, eval_end):
+    return pd.read_csv(
+        results_csv_path(noise, eval_start, eval_end),
+        names=col_names,
+        header=None,
+    )
+
+
+def read_results_csv(noise, eval_start, eval_end):
+    return clean_results(
+        parse_results_csv(noise, eval_start, eval_end),
+        noise,
+        source=results_csv_path(noise, eval_start, eval_end),
+    )
+
+
+def concat_results(frames):
+    """Concatenate results frames, keeping categorical columns categorical."""
+    data = {}
+    for col in frames[0].columns:
+        parts = [df[col] for df in frames]
+        if all(isinstance(p.dtype, pd.CategoricalDtype) for p in parts):
+            data[col] = union_categoricals(parts)
+        else:
+            data[col] = np.concatenate([p.to_numpy() for p in parts])
+    return pd.DataFrame(data)
+
+
+def write_store(df, path, source=None):
+    os.makedirs(path, exist_ok=True)
+    columns = {}
+    for i, col in enumerate(df.columns):
+        fname = f"c{i:02d}.npy"  # column names contain characters like "/" and "<"
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(path, fname), values.cat.codes.to_numpy())
+            categories = values.cat.categories.tolist()
+        else:
+            np.save(os.path.join(path, fname), values.to_numpy())
+            categories = None
+        columns[col] = {"file": fname, "categories": categories}
+    meta = {
+        "n_rows": len(df),
+        "source": source,
+        "schema_version": SCHEMA_VERSION,
+        "columns": columns,
+    }
+    # meta.json is written last so a partially written store is never opened
+    with open(os.path.join(path, META_FILE), "w") as f:
+        json.dump(meta, f, indent=1)
+
+
+def read_meta(path):
+    try:
+        with open(os.path.join(path, META_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def open_store(path, meta=None):
+    """Open a converted dataset as a DataFrame backed by memory-mapped arrays."""
+    meta = meta or read_meta(path)
+    data = {}
+    for col, info in meta["columns"].items():
+        values = np.load(os.path.join(path, info["file"]), mmap_mode="r")
+        if info["categories"] is not None:
+            values = pd.Categorical.from_codes(values, info["categories"])
+        data[col] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def store_is_fresh(meta, noise, eval_start, eval_end):
+    """A store is stale if its source CSV or the schema changed since ingest."""
+    if meta.get("schema_version") != SCHEMA_VERSION:
+        return False
+    source = file_fingerprint(results_csv_path(noise, eval_start, eval_end))
+    return source is None or meta["source"] == list(source)
+
+
+def fresh_store_path(noise, eval_start, eval_end):
+    """Path of the converted dataset, or None if it is missing or stale."""
+    path = dataset_store_path(noise, eval_start, eval_end)
+    meta = read_meta(path)
+    if meta is not None and store_is_fresh(meta, noise, eval_start, eval_end):
+        return path
+    return None
+
+
+def load_results(noise, eval_start, eval_end):
+    """Load one results file, preferring the columnar store over the CSV.
+
+    The rows are sorted by block_index.sort_keys either way.
+    """
+    with stage("read"):
+        path = fresh_store_path(noise, eval_start, eval_end)
+        if path is not None:
+            return open_store(path)
+        df, _ = sort_results(read_results_csv(noise, eval_start, eval_end))
+        return df
+
+
+def iter_results(noise, eval_start, eval_end, chunk_rows):
+    """Results of one file in chunks of chunk_rows rows, without loading it all."""
+    path = fresh_store_path(noise, eval_start, eval_end)
+    if path is not None:
+        df = open_store(path)  # memory-mapped, slices are read on demand
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start : start + chunk_rows]
+        return
+    chunks = pd.read_csv(
+        results_csv_path(noise, eval_start, eval_end),
+        names=col_names,
+        header=None,
+        chunksize=chunk_rows,
+    )
+    for chunk in chunks:
+        yield clean_results(
+            chunk, noise, source=results_csv_path(noise, eval_start, eval_end)
+        )
+
+
+def parse_dataset_name(fname):
+    """Split '03_13_{noise}_{eval_start}_{eval_end}.csv' into its parts."""
+    stem = os.path.basename(fname)[: -len(".csv")]
+    for noise in noise_levels:
+        for eval_start in eval_starts:
+            for eval_end in eval_ends:
+                if stem == f"{RESULTS_PREFIX}_{noise}_{eval_start}_{eval_end}":
+                    return noise, eval_start, eval_end
+    return None
+
+
+def ingest(force=False):
+    """Convert every noise x eval-window CSV in DATA_DIR into the columnar store."""
+    converted = []
+    for fname in sorted(glob.glob(os.path.join(DATA_DIR, f"{RESULTS_PREFIX}_*.csv"))):
+        parts = parse_dataset_name(fname)
+        if parts is None:
+            print(f"skipping {fname}: unrecognised dataset name")
+            continue
+        path = dataset_store_path(*parts)
+        meta = read_meta(path)
+        if not force and meta is not None and store_is_fresh(meta, *parts):
+            continue
+        df = parse_results_csv(*parts)
+        raw_bytes = bytes_per_row(df)
+        df, index = sort_results(clean_results(df, parts[0], source=fname))
+        write_store(df, path, source=list(file_fingerprint(fname)))
+        index.save(os.path.join(path, INDEX_FILE))
+        AggregateCube.from_frame(df).save(os.path.join(path, CUBE_FILE))
+        QuantileSketch.from_frame(df).save(os.path.join(path, SKETCH_FILE))
+        print(
+            f"{fname} -> {path} ({len(df)} rows, "
+            f"{raw_bytes:.0f} -> {bytes_per_row(df):.0f} bytes/row)"
+        )
+        converted.append(parts)
+    return converted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("ingest", help="convert results CSVs into the columnar store")
+    p.add_argument("--force", action="store_true", help="re-convert fresh stores")
+    args = parser.parse_args(argv)
+    if args.command == "ingest":
+        ingest(force=args.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""aggregate_results must give the same means on every path.
+
+The in-memory, streaming and cube paths, from the CSVs and from the converted
+store, are compared with each other and with the groupby/np.average code the
+app used before them, on synthetic results (benchmarks/synthetic.py).
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+# config reads DATA_DIR when imported
+DATA_DIR = tempfile.mkdtemp(prefix="t1d-pa-test-")
+os.environ["DATA_DIR"] = DATA_DIR
+
+import pipeline  # noqa: E402
+import store  # noqa: E402
+import synthetic  # noqa: E402
+from config import col_names, metrics_list, mu, noise_levels, sigma  # noqa: E402
+from weighting import lognormal_pdf  # noqa: E402
+
+EVAL_START, EVAL_END = synthetic.default_window
+
+combinations = [
+    # selected_activity, pa_duration, noise, max_netiob, min_glucose, max_glucose
+    ("walking", 30, "nonoise", 3, 70, 250),
+    ("strength training", "all", "all", 1, 90, 200),
+]
+
+
+@pytest.fixture(scope="module", autouse=True)
+def data_dir():
+    synthetic.write_datasets(DATA_DIR, rows=1)
+    yield DATA_DIR
+    shutil.rmtree(DATA_DIR, ignore_errors=True)
+
+
+def baseline_means(
+    selected_activity,
+    pa_duration,
+    noise,
+    max_netiob,
+    averaging,
+    min_glucose,
+    max_glucose,
+):
+    """Means as computed by the original update_plot."""
+    levels = noise_levels if noise == "all" else [noise]
+    frames = []
+    for noise_level in levels:
+        df = pd.read_csv(
+            os.path.join(DATA_DIR, f"03_13_{noise_level}_{EVAL_START}_{EVAL_END}.csv"),
+            names=col_names,
+            header=None,
+        )
+        df["noise"] = noise_level
+        frames.append(df)
+    df = pd.concat(frames, ignore_index=True)
+    df["activity"] = df["activity"].replace("rength training", "strength training")
+    df["weight"] = lognormal_pdf(df["starting_glucose"], mu, sigma)
+    df = df[
+        (df["activity"] == selected_activity)
+        & (df["netIoB"] <= max_netiob)
+        & ((df["pa_duration"] == pa_duration) if pa_duration != "all" else True)
+        & (df["starting_glucose"] >= min_glucose)
+        & (df["starting_glucose"] <= max_glucose)
+        & (df["target_min"] < 180)
+    ]
+    df = df[metrics_list + ["weight", "target_min", "preset"]]
+    groups = df.groupby(["target_min", "preset"])
+    if averaging == "Unweighted":
+        df_avg = groups[metrics_list].mean()
+    else:
+        df_avg = groups[metrics_list + ["weight"]].apply(
+            lambda g: pd.Series(
+                np.average(g[metrics_list], weights=g["weight"], axis=0),
+                index=metrics_list,
+            )
+        )
+    return df_avg.reset_index().round(2)
+
+
+def aggregate(combination, averaging):
+    activity, pa_duration, noise, max_netiob, min_glucose, max_glucose = combination
+    return pipeline.aggregate_results(
+        activity,
+        pa_duration,
+        noise,
+        max_netiob,
+        averaging,
+        min_glucose,
+        max_glucose,
+        EVAL_START,
+        EVAL_END,
+    )
+
+
+def assert_same_means(df_avg, expected, path):
+    merged = expected.merge(
+        df_avg, on=["target_min", "preset"], how="outer", suffixes=("", " new")
+    )
+    assert len(merged) == len(expected) == len(df_avg), path
+    for metric in metrics_list:
+        # metrics are stored as float32, which can flip the last rounded digit
+        np.testing.assert_allclose(
+            merged[f"{metric} new"],
+            merged[metric],
+            atol=0.0101,
+            err_msg=f"{path}: {metric}",
+        )
+
+
+@pytest.mark.parametrize("averaging", ["Unweighted", "Weighted"])
+@pytest.mark.parametrize("combination", combinations)
+def test_paths_match_baseline(monkeypatch, combination, averaging):
+    args = combination[:4] + (averaging,) + combination[4:]
+    expected = baseline_means(*args)
+    shutil.rmtree(os.path.join(DATA_DIR, "store"), ignore_errors=True)
+
+    paths = {"csv": aggregate(combination, averaging)}
+    with monkeypatch.context() as m:
+        m.setattr(pipeline, "STREAMING_CHUNK_ROWS", 5000)
+        paths["csv streaming"] = aggregate(combination, averaging)
+
+    store.ingest()
+    assert pipeline.get_cube(combination[2], EVAL_START, EVAL_END) is not None
+    paths["cube"] = aggregate(combination, averaging)
+    with monkeypatch.context() as m:
+        m.setattr(pipeline, "get_cube", lambda *key: None)
+        paths["store"] = aggregate(combination, averaging)
+        m.setattr(pipeline, "STREAMING_CHUNK_ROWS", 5000)
+        paths["store streaming"] = aggregate(combination, averaging)
+
+    for path, df_avg in paths.items():
+        assert_same_means(df_avg, expected, path)
@@ -0,0 +1,78 @@
+"""bootstrap_intervals against a plain per-group bootstrap loop."""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aggregation import bootstrap_intervals  # noqa: E402
+
+N_RESAMPLES = 2000
+
+
+def make_data(seed=0):
+    """Three groups of different sizes; the middle metric is 20% NaN."""
+    rng = np.random.default_rng(seed)
+    sizes = [60, 90, 150]
+    inverse = np.repeat(np.arange(len(sizes)), sizes)
+    rng.shuffle(inverse)
+    n = len(inverse)
+    values = np.column_stack(
+        [
+            rng.normal(50, 5, n) + 10 * inverse,
+            rng.normal(20, 2, n),
+            rng.normal(10, 0.5, n),
+        ]
+    )
+    values[rng.random(n) < 0.2, 1] = np.nan
+    weights = rng.uniform(0.1, 1, n)
+    return values, inverse, len(sizes), weights
+
+
+def loop_intervals(values, inverse, n_groups, weights, seed=1):
+    """Percentile bootstrap of the weighted means, one group and metric at a time."""
+    rng = np.random.default_rng(seed)
+    lo = np.full((n_groups, values.shape[1]), np.nan)
+    hi = np.full_like(lo, np.nan)
+    for g in range(n_groups):
+        rows = np.flatnonzero(inverse == g)
+        draws = rng.integers(0, len(rows), size=(N_RESAMPLES, len(rows)))
+        for j in range(values.shape[1]):
+            v, w = values[rows, j], weights[rows]
+            present = ~np.isnan(v)
+            sums = (np.where(present, v, 0) * w)[draws].sum(axis=1)
+            means = sums / (present * w)[draws].sum(axis=1)
+            lo[g, j], hi[g, j] = np.quantile(means, [0.025, 0.975])
+    return lo, hi
+
+
+@pytest.mark.parametrize("weighted", [False, True])
+def test_matches_loop(weighted):
+    values, inverse, n_groups, weights = make_data()
+    if not weighted:
+        weights = np.ones(len(inverse))
+    lo, hi = bootstrap_intervals(
+        values,
+        inverse,
+        n_groups,
+        weights if weighted else None,
+        n_resamples=N_RESAMPLES,
+    )
+    lo_ref, hi_ref = loop_intervals(values, inverse, n_groups, weights)
+    # different draws: the bounds agree up to the bootstrap's own noise
+    width = hi_ref - lo_ref
+    np.testing.assert_allclose(lo, lo_ref, atol=0.15 * width.max())
+    np.testing.assert_allclose(hi, hi_ref, atol=0.15 * width.max())
+    np.testing.assert_allclose(hi - lo, width, rtol=0.2)
+
+
+def test_metric_independent_of_the_others():
+    values, inverse, n_groups, weights = make_data()
+    lo, hi = bootstrap_intervals(values, inverse, n_groups, weights)
+    for j in range(values.shape[1]):
+        lo_j, hi_j = bootstrap_intervals(values[:, [j]], inverse, n_groups, weights)
+        np.testing.assert_array_equal(lo[:, [j]], lo_j)
+        np.testing.assert_array_equal(hi[:, [j]], hi_j)
@@ -0,0 +1,81 @@
+"""Quantiles from the sketches against exact weighted quantiles of the rows."""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import metrics_list  # noqa: E402
+from cube import axis_names  # noqa: E402
+from sketch import SKETCH_SIZE, QuantileSketch, weighted_quantiles  # noqa: E402
+
+QUANTILES = [0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99]
+GLUCOSE = [90, 120, 150]
+GLUCOSE_WEIGHTS = np.array([0.5, 1.0, 2.0])
+SD = 5.0
+
+
+def make_frame(per_cell, seed=0):
+    """per_cell simulations in every cell of a small grid; one metric 10% NaN."""
+    rng = np.random.default_rng(seed)
+    grid = pd.MultiIndex.from_product(
+        [["a", "b"], [30, 60], [0.0, 1.0], GLUCOSE, [100, 120], ["p1", "p2"]],
+        names=axis_names,
+    ).to_frame(index=False)
+    df = grid.loc[grid.index.repeat(per_cell)].reset_index(drop=True)
+    for m in metrics_list:
+        # float32 like the stored metrics, so single values are kept exactly
+        df[m] = rng.normal(50, SD, len(df)).astype(np.float32)
+    df.loc[rng.random(len(df)) < 0.1, metrics_list[1]] = np.nan
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def intervention_codes(target_min, preset):
+    keys = pd.Series(target_min).astype(str) + "/" + pd.Series(preset).astype(str)
+    return pd.factorize(keys, sort=True)[0]
+
+
+def sketch_quantiles(sketch, metric):
+    target_min, preset, glucose, means, counts = sketch.centroids(
+        "all", "all", 1.0, GLUCOSE[0], GLUCOSE[-1], metric
+    )
+    group = intervention_codes(target_min, preset)
+    weights = counts * GLUCOSE_WEIGHTS[glucose]
+    return weighted_quantiles(
+        group, means.astype(np.float64), weights, group.max() + 1, QUANTILES
+    )
+
+
+def exact_quantiles(df, metric):
+    values = df[metric].to_numpy(dtype=np.float64)
+    present = ~np.isnan(values)
+    group = intervention_codes(df["target_min"], df["preset"])
+    weights = GLUCOSE_WEIGHTS[np.searchsorted(GLUCOSE, df["starting_glucose"])]
+    return weighted_quantiles(
+        group[present], values[present], weights[present], group.max() + 1, QUANTILES
+    )
+
+
+@pytest.mark.parametrize("per_cell", [1, SKETCH_SIZE])
+def test_small_cells_exact(per_cell):
+    df = make_frame(per_cell)
+    sketch = QuantileSketch.from_frame(df)
+    for metric in metrics_list:
+        np.testing.assert_array_equal(
+            sketch_quantiles(sketch, metric), exact_quantiles(df, metric)
+        )
+
+
+@pytest.mark.parametrize("per_cell", [40, 200])
+def test_large_cells_within_tolerance(per_cell):
+    # the tolerance documented in sketch.py, in standard deviations
+    df = make_frame(per_cell)
+    sketch = QuantileSketch.from_frame(df)
+    for metric in metrics_list:
+        error = np.abs(sketch_quantiles(sketch, metric) - exact_quantiles(df, metric))
+        assert error[:, 1:-1].max() < 0.15 * SD
+        assert error[:, [0, -1]].max() < 0.4 * SD
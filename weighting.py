@@ -0,0 +1,85 @@
+"""Weighting of simulations by a starting glucose distribution.
+
+Starting glucose takes only a handful of distinct values, so the density is
+evaluated once per distinct value into a small table (memoized per
+distribution and parameters) and joined to the rows by integer code.
+"""
+
+import functools
+
+import numpy as np
+
+from config import mu, sigma
+
+_SQRT_2PI = np.sqrt(2 * np.pi)
+
+
+def lognormal_pdf(g, mu, sigma):
+    """Density of a log-normal with log mean mu and log standard deviation sigma."""
+    g = np.asarray(g, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (np.log(g) - mu) / sigma
+        pdf = np.exp(-0.5 * z**2) / (sigma * g * _SQRT_2PI)
+    return np.where(g > 0, pdf, 0.0)
+
+
+def normal_pdf(g, mean, std):
+    z = (np.asarray(g, dtype=float) - mean) / std
+    return np.exp(-0.5 * z**2) / (std * _SQRT_2PI)
+
+
+# distribution name -> (label, density(glucose, p1, p2), default parameters)
+distributions = {
+    "lognormal": (
+        "Log-normal (T1DEXI)",
+        lognormal_pdf,
+        (mu, sigma),
+    ),
+    "normal": (
+        "Normal",
+        normal_pdf,
+        (140.0, 50.0),
+    ),
+    "uniform": ("Uniform", lambda g, p1, p2: np.ones(len(g)), (None, None)),
+}
+DEFAULT_WEIGHTING = ("lognormal", mu, sigma)
+MAX_TABLE_SIZE = 4096  # integer glucose ranges up to this size use a direct table
+
+
+def weighting_params(distribution, p1=None, p2=None):
+    """(distribution, p1, p2) with missing parameters set to their defaults."""
+    if distribution not in distributions:
+        raise ValueError(f"unknown weighting distribution {distribution!r}")
+    d1, d2 = distributions[distribution][2]
+    p1, p2 = (d1 if p1 is None else p1), (d2 if p2 is None else p2)
+    if p2 is not None and p2 <= 0:
+        raise ValueError(f"weighting σ must be positive, got {p2}")
+    return (distribution, p1, p2)
+
+
+@functools.lru_cache(maxsize=256)
+def _weight_table(values, distribution, p1, p2):
+    table = distributions[distribution][1](np.array(values, dtype=float), p1, p2)
+    table = np.asarray(table, dtype=float)
+    table.setflags(write=False)  # shared between callers
+    return table
+
+
+def weight_table(values, distribution="lognormal", p1=None, p2=None):
+    """Weight of each of the given starting glucose values."""
+    distribution, p1, p2 = weighting_params(distribution, p1, p2)
+    return _weight_table(tuple(np.asarray(values).tolist()), distribution, p1, p2)
+
+
+def glucose_weights(starting_glucose, distribution="lognormal", p1=None, p2=None):
+    """Weight of each simulation based on its starting glucose."""
+    g = np.asarray(starting_glucose)
+    if len(g) == 0:
+        return np.zeros(0)
+    if np.issubdtype(g.dtype, np.integer):
+        lo, hi = int(g.min()), int(g.max())
+        if hi - lo < MAX_TABLE_SIZE:
+            table = weight_table(range(lo, hi + 1), distribution, p1, p2)
+            return table[g - lo]
+    values, codes = np.unique(g, return_inverse=True)
+    return weight_table(values, distribution, p1, p2)[codes]